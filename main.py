@@ -1,33 +1,79 @@
+import argparse
 import asyncio
-import contextlib
+import atexit
 import json
 import logging
+import os
 import re
 import subprocess
 import time
+from logging.handlers import RotatingFileHandler
 from pathlib import Path
 from typing import List
 
 import aiosqlite
-import keyboard
-import pytesseract
 import unicodedata
-from PIL import Image, ImageGrab
-from rapidfuzz.distance import DamerauLevenshtein
 
-from modules.databases import create_database
-from modules.logs import add_logging_level
-
-with contextlib.redirect_stdout(None):
-    import pygame
+from modules.audio import NullAudio, PygameAudio
+from modules.capture import ScreenCapture
+from modules.config import instance_settings, load_config
+from modules.databases import connect_database, create_database, default_best_attempt, default_best_completion
+from modules.detection import RunDetector
+from modules.gating import FrameGate
+from modules.hotkeys import KeyboardHotkeys
+from modules.metrics import Metrics
+from modules.music import format_duration, search_music, song_available, update_music_index
+from modules.persistence import PersistenceWriter
+from modules.pipeline import DetectionPipeline
+from modules.scheduler import PollingScheduler
+from modules.screenshots import ScreenshotWriter
+from modules.stats import format_stats, map_stats
+from modules.replay import ReplaySource, benchmark, record_frames, replay
+from modules.templates import TemplateDetector
+from modules.logs import JsonFormatter, add_logging_level, start_queue_logging
+from modules.matcher import PhraseMatcher
+from modules.ocr import OCRPool
 
 # misc configs
 database_name = 'fe2_companion_data.sqlite'
-pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
-
-# strings
-play_strings = ["get ready: ", "rescue"]
-stop_strings = ["round", "join", "next", "drowned"]
+config_name = 'config.json'
+tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
+ocr_backend = 'auto'  # 'tesserocr' keeps one engine loaded for the whole session, 'pytesseract' spawns one per frame
+
+# mean pixel difference (0-255) any 32x32 patch of a region needs before it's OCR'd again, and how long to idle when
+# nothing changed
+frame_change_threshold = 4.0
+unchanged_frame_sleep = 0.05
+metrics_interval = 300  # seconds between stage timing summaries in the log
+metrics_path = None  # set with --metrics, gets the stage timings in Prometheus text format
+# every log record as one JSON object per line, rotated at log_max_bytes. None turns the log file off
+log_path = 'logs/latest.jsonl'
+log_max_bytes = 10 * 1024 * 1024
+log_backups = 5
+persistence_flush_interval = 2.0  # seconds between writes of the session and map totals, they're also written on exit
+# templates/<play|stop|escaped>/<name>.png are matched before falling back to OCR
+templates_path = 'templates'
+template_threshold = 0.85
+# which regions each kind of trigger is searched in
+trigger_regions = {
+    'play': ['ready', 'rescue'],
+    'stop': ['notifications'],  # the ready region's whitelist can't spell any of the stop phrases
+    'escaped': ['rescue'],
+}
+
+# strings, found anywhere in the text of their trigger's regions with up to max_distance typos (default 0)
+trigger_phrases = [
+    {'trigger': 'play', 'phrase': "get ready: "},
+    {'trigger': 'play', 'phrase': "get ready: 3", 'max_distance': 3, 'exclude': [".."]},
+    {'trigger': 'play', 'phrase': "get ready: 2", 'max_distance': 3, 'exclude': [".."]},
+    {'trigger': 'play', 'phrase': "get ready: 1", 'max_distance': 3, 'exclude': [".."]},
+    {'trigger': 'play', 'phrase': "rescue"},
+    {'trigger': 'stop', 'phrase': "round"},
+    {'trigger': 'stop', 'phrase': "join"},
+    {'trigger': 'stop', 'phrase': "next"},
+    {'trigger': 'stop', 'phrase': "drowned"},
+    {'trigger': 'escaped', 'pattern': r"(\d+)/(\d+) escaped"},
+]
 
 # poggers
 add_logging_level('SUCCESS', 21)
@@ -35,12 +81,6 @@ add_logging_level('MATCH', 22)
 add_logging_level('BYE', 23)
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
-file_handler = logging.FileHandler('latest.log', mode='w')
-file_handler.setLevel(logging.DEBUG)
-file_handler.setFormatter(
-    logging.Formatter('[%(asctime)s.%(msecs)d] [%(levelname)s] (%(filename)s:%(lineno)d) %(message)s',
-                      '%m/%d/%Y %H:%M:%S'
-                      ))
 
 
 class SpecialFormatter(logging.Formatter):
@@ -86,23 +126,32 @@ class SpecialFormatter(logging.Formatter):
         logging.CRITICAL: f"{red_background}{bold}{time_string}{reset} {red}{bold}{level_string}{reset} {red}{message_string}{reset}"
     }
 
+    def __init__(self):
+        super().__init__()
+        self.formatters = {level: logging.Formatter(log_fmt, self.date_format) for level, log_fmt in self.FORMATS.items()}
+        self.default_formatter = logging.Formatter(None, self.date_format)
+
     def format(self, record):
-        log_fmt = self.FORMATS.get(record.levelno)
-        formatter = logging.Formatter(log_fmt, self.date_format)
-        return formatter.format(record)
+        return self.formatters.get(record.levelno, self.default_formatter).format(record)
 
 
 special_formatter = SpecialFormatter()
 console_handler = logging.StreamHandler()
 console_handler.setLevel(logging.INFO)
 console_handler.setFormatter(special_formatter)
-logger.addHandler(file_handler)
+modules_logger = logging.getLogger('modules')
+modules_logger.setLevel(logging.DEBUG)
+# the console is written right away, so log lines stay in order with the menus' print() and input()
 logger.addHandler(console_handler)
-
-# best templates
-template_best_attempt = {"attempt": 0, "time": 0}
-template_best_completion = {"attempt": 0, "time": 999999}
-
+modules_logger.addHandler(console_handler)
+if log_path:
+    Path(log_path).parent.mkdir(parents=True, exist_ok=True)
+    file_handler = RotatingFileHandler(log_path, maxBytes=log_max_bytes, backupCount=log_backups, encoding='utf-8')
+    file_handler.setLevel(logging.DEBUG)
+    file_handler.setFormatter(JsonFormatter())
+    # every record goes to the JSON log, formatted and written on the listener's thread instead of the event loop
+    log_listener = start_queue_logging([logger, modules_logger], [file_handler])
+    atexit.register(log_listener.stop)
 
 async def slugify(value, allow_unicode=False):
     """
@@ -122,40 +171,35 @@ async def slugify(value, allow_unicode=False):
 
 
 async def find_select_music():
-    music_files = list(
-        reversed(
-            list(
-                p.resolve()
-                for p in Path("music").glob("**/*")
-                if p.suffix in {'.mp3', '.ogg', '.wav'}
-            )
-        )
-    )
-    if len(music_files) == 0:
+    async with database.execute('SELECT count(*) FROM music') as cursor:
+        song_count = (await cursor.fetchone())[0]
+    if song_count == 0:
         logger.warning("No music files detected in music folder!")
         return None
-    elif len(music_files) == 1:
-        return music_files[0].__str__().replace(music_files[0].cwd().__str__(), "")[1:].replace("\\", "/")
-    else:
-        displayable_paths = []
-        for path in music_files:
-            displayable_paths.append(path.__str__().replace(music_files[0].cwd().__str__(), "")[1:].replace("\\", "/"))
-
-        while True:
-            logger.info(f"{len(displayable_paths)} Songs Found! "
-                        f"Type the number for the song you want this map to play, or simply press enter for no music.\n"
-                        # f"{'=' * os.get_terminal_size().columns}"
-                        f"")
-            for i, dpath in enumerate(displayable_paths, 1):
-                print(f"{i}. {dpath}")
+    elif song_count == 1:
+        return (await search_music(database, '', 1))[0]['path']
 
-            try:
-                selection = input("\nSong Number (or enter): ")
-                if len(selection) == 0:
-                    return None
-                return displayable_paths[int(selection) - 1]
-            except ValueError:
-                logger.error("Invalid selection!")
+    while True:
+        query = input(f"\nSearch {song_count} songs by name (or enter for no music): ")
+        if len(query) == 0:
+            return None
+        songs = await search_music(database, query)
+        if not songs:
+            logger.error("No songs found!")
+            continue
+
+        logger.info(f"{len(songs)} Songs Found! "
+                    f"Type the number for the song you want this map to play, or press enter to search again.\n")
+        for i, song in enumerate(songs, 1):
+            print(f"{i}. {song['name']} ({format_duration(song['duration'])}) | {song['path']}")
+
+        try:
+            selection = input("\nSong Number (or enter): ")
+            if len(selection) == 0:
+                continue
+            return songs[int(selection) - 1]['path']
+        except (ValueError, IndexError):
+            logger.error("Invalid selection!")
 
 
 async def choose_volume():
@@ -171,34 +215,15 @@ async def choose_volume():
             return
 
 
-async def combine_images(images: List[ImageGrab]):
-    widths, heights = zip(*[img.size for img in images])
-    horizontal_padding = 600
-    vertical_padding = 600
-    image_width = max(widths) + horizontal_padding
-    image_height = sum(heights) + vertical_padding
-    new_img = Image.new('RGB', (image_width, image_height))
-
-    x_offset = int(horizontal_padding * 0.5)
-    y_offset = int(vertical_padding * 0.5)
-    for img in images:
-        new_img.paste(img, (x_offset, y_offset))
-        y_offset += img.height
-
-    return new_img
-
-
 async def submit_new_map():
     new_map = input("Enter name of map (enter to cancel): ")
     if len(new_map) == 0:
         return
     song = await find_select_music()
-    best_attempt = template_best_attempt.copy()
-    best_completion = template_best_completion.copy()
-    cursor = await database.execute('INSERT INTO maps VALUES(?, ?, ?, ?, ?, ?)',
-                                    [new_map, song, 0, 0, json.dumps(best_attempt), json.dumps(best_completion)])
-    await database.commit()
-    return {'rowid': cursor.lastrowid, 'name': new_map, 'song': song, 'total_attempts': 0, 'total_completions': 0,
+    best_attempt = default_best_attempt.copy()
+    best_completion = default_best_completion.copy()
+    map_id = await persistence.write('INSERT INTO maps (name, song) VALUES(?, ?)', [new_map, song])
+    return {'id': map_id, 'name': new_map, 'song': song, 'total_attempts': 0, 'total_completions': 0,
             'best_attempt': best_attempt,
             'best_completion': best_completion}
 
@@ -232,16 +257,23 @@ async def select_map_from_list(map_list: List[dict]):
 
 
 async def query_map_table():
-    async with database.execute('SELECT rowid, * FROM maps') as cursor:
+    async with database.execute('SELECT * FROM maps') as cursor:
         data = await cursor.fetchall()
         column_names = [description[0] for description in cursor.description]
         map_data = []
         for row in data:
             row_dict = dict(zip(column_names, row))
+            for kind in ('attempt', 'completion'):
+                row_dict[f'best_{kind}'] = {'attempt': row_dict.pop(f'best_{kind}_number'),
+                                            'time': row_dict.pop(f'best_{kind}_time')}
             map_data.append(row_dict)
         return map_data
 
 
+def best_columns(kind: str, best: dict) -> dict:
+    return {f'best_{kind}_time': best['time'], f'best_{kind}_number': best['attempt']}
+
+
 async def select_map():
     map_list = await query_map_table()
     if len(map_list) == 0:
@@ -267,202 +299,557 @@ async def compare_run(compare_type: str, run_attempt: int, run_time: float, best
     return new_best
 
 
-async def check_distance(target_word: str, word_list: List[str], max_distance: int):
-    for entry in word_list:
-        if '..' in target_word or 'get ready..' in target_word:
-            continue
-        distance = DamerauLevenshtein.distance(target_word, entry)
-        # logger.debug(f"{entry} is {distance} from {target_word}")
-        if distance <= max_distance:
-            return True
+class Companion:
+    """
+    The parts of the tracker that live as long as the process: the database, config, screen capture, OCR engines,
+    templates, audio mixer, hotkeys and the write-behind writer. Every instance (see `Instance`) gets its own screen
+    capture, everything else is shared between them.
 
+    The heavy ones are built on a worker thread as soon as the app starts, while the first prompts are up, and
+    switching maps only starts a new session on top of them instead of rebuilding everything.
+    """
 
-async def main():
-    # git_hash = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD']).decode('ascii').strip()
-    # logger.info(f"FE2 Companion by pinheadtf2 [{git_hash}]")
-    logger.info(f"FE2 Companion by pinheadtf2")
+    def __init__(self):
+        self.config = load_config(config_name)
+        self.instances = instance_settings(self.config)
+        self.database = None
+        self.persistence = None
+        self.hotkeys = None
+        self.warm_up = None
+
+    async def start(self):
+        global database, persistence
+        if not Path(database_name).exists():
+            await create_database(database_name)
+            logger.info(f"Created database {database_name}")
+        self.database = database = await connect_database(database_name)
+        # run_in_executor starts right away, unlike a task, so this keeps going while input() blocks the event loop
+        self.warm_up = asyncio.get_running_loop().run_in_executor(None, self._build)
+        logger.info(f"Indexed {await update_music_index(database)} songs")
+        self.persistence = persistence = PersistenceWriter(database, persistence_flush_interval)
+        self.persistence.start()
+        self.hotkeys = KeyboardHotkeys(('k', 'm', *(key for settings in self.instances for key in settings['hotkeys'])))
+
+    def _build(self):
+        build_start = time.perf_counter()
+        config = self.config
+        self.screen_captures = {settings['name']: ScreenCapture(config['regions'],
+                                                                config['capture']['reference_resolution'],
+                                                                settings['window'])
+                                for settings in self.instances}
+        # one set of engines for every instance: a worker per region and instance, but no more than one per core
+        region_count = len(config['regions'])
+        workers = max(region_count, min(region_count * len(self.instances), os.cpu_count() or 1))
+        self.ocr_pool = OCRPool(config['regions'], ocr_backend, 'eng', tesseract_cmd, workers)
+        self.ocr_pool.warm_up()
+        self.template_detector = TemplateDetector(trigger_regions, templates_path, template_threshold)
+        self.matcher = PhraseMatcher(trigger_phrases)
+        self.audio = PygameAudio(**config['audio'])
+        screenshot_settings = config['screenshots']
+        self.screenshot_writer = ScreenshotWriter('images/completions', screenshot_settings['format'],
+                                                  screenshot_settings['compress_level'],
+                                                  screenshot_settings['quality'], screenshot_settings['thumbnail'],
+                                                  screenshot_settings['keep'], screenshot_settings['max_age_days'])
+        # the first grab sets up the capture backend and the region boxes, and matching it fills the template caches
+        for screen_capture in self.screen_captures.values():
+            grabbed = screen_capture.grab()
+            self.template_detector.detect(grabbed[1])
+        logger.debug(f"Loaded {workers} OCR engines ({self.ocr_pool.name}), audio and capture in "
+                     f"{time.perf_counter() - build_start:.3f} seconds")
+
+    async def ready(self):
+        await self.warm_up
+
+    async def close(self):
+        if self.persistence:
+            await self.persistence.close()
+        if self.hotkeys:
+            self.hotkeys.close()
+        if self.warm_up:
+            try:
+                await self.warm_up
+            except Exception:  # already raised when the first session waited on it
+                pass
+            else:
+                self.screenshot_writer.close()
+                self.ocr_pool.close()
+        if self.database:
+            await self.database.close()
 
-    Path('images/completions').mkdir(exist_ok=True)
-    Path('music').mkdir(exist_ok=True)
-    if not Path(database_name).exists():
-        await create_database(database_name)
-        logger.info(f"Created database {database_name}")
-    global database
-    database = await aiosqlite.connect(database_name)
-
-    selected_map = await select_map()
-    selected_map['best_attempt'] = json.loads(selected_map['best_attempt'].replace("\'", "\""))  # just in case
-    selected_map['best_completion'] = json.loads(selected_map['best_completion'].replace("\'", "\""))
-
-    pygame.mixer.init()
-    volume = 0
-    if not selected_map['song']:
-        pygame.mixer.music.load('music/Hyperspace - V2 - luxTypes.mp3')
-        pygame.mixer.music.set_volume(volume)
-    else:
-        play_song_query = input(f"Play map's song {selected_map['song']} (Y/n)?")
-        if len(play_song_query) == 0 or play_song_query[0].lower() == 'y':
-            pygame.mixer.music.load(selected_map['song'])
-            volume = await choose_volume()
-            pygame.mixer.music.set_volume(volume)
-    logger.info(f"Initialized music player with song {selected_map['song']} at volume {volume}")
-
-    # this is where the session is officially declared as 'started'
-    session_start = int(time.time())
-    session_best_attempt = template_best_attempt.copy()
-    session_best_completion = template_best_completion.copy()
-    cursor = await database.execute('INSERT INTO sessions VALUES(?, ?, ?, ?, ?, ?, ?)',
-                                    [selected_map['name'], session_start, None, 0, 0, str(session_best_attempt),
-                                     str(session_best_completion)])
-    run_id = cursor.lastrowid
-    await database.commit()
-
-    logger.info(f"Started session {run_id} with map {selected_map['name']}\n"
-                f"{" " * 33}Map Totals: {selected_map['total_attempts']} attempts, {selected_map['total_completions']} completions\n"
-                f"{" " * 33}Map Best Attempt: {selected_map['best_attempt']['time']} seconds (Att. {selected_map['best_attempt']['attempt']})\n"
-                f"{" " * 33}Map Best Completion: {selected_map['best_completion']['time']} seconds (Att. {selected_map['best_completion']['attempt']})")
-
-    running = False
-    attempts = 0
-    completions = 0
-    run_start = None
-    while True:
-        perf_start = time.perf_counter()
-        image_ready = ImageGrab.grab(bbox=(320, 850, 1000, 1000))
-        image_notifications = ImageGrab.grab(bbox=(600, 0, 1300, 300))
-        image_rescue = ImageGrab.grab(bbox=(700, 870, 1250, 990))
-        # image_share = ImageGrab.grab(bbox=(150, 0, 550, 50))
-
-        screenshot = await combine_images([image_ready, image_notifications, image_rescue])
-        text = pytesseract.image_to_string(screenshot, lang='eng').strip().replace("\n", " ").lower()
-        # screenshot_name = f'images/image_{time.time():.3f}.png'
-        # screenshot.save(screenshot_name)
-        # logger.debug(f"Saved image {screenshot_name} | Text: {text}")
-
-        if (any((match := partial) in text for partial in play_strings) or await check_distance(text[:12], ["get ready: 3", "get ready: 2", "get ready: 1"], 3)) and not running:
-            running = True
-            if 'get ready:' in text:
-                logger.info(f"Matched, pausing for get ready: ")
-                await asyncio.sleep(1.2)
-
-            pygame.mixer.music.play()
-            run_start = time.time()
-            attempts += 1
-            if match not in text:
-                match = "[Lev. Dist. Match]"
-            logger.match(f"Attempt {attempts} of {selected_map['name']}\n"
-                         f"{" " * 34}Matches: {match} | All Text: {text}")
-            continue
-        elif (any((match := partial) in text for partial in stop_strings) or keyboard.is_pressed('g')) and running:
-            running = False
-            pygame.mixer.music.stop()
-            run_time = round(time.time() - run_start, 3)
-            total_attempts = selected_map['total_attempts'] + attempts
-
-            session_attempt_comparison = await compare_run('attempt', attempts, run_time, session_best_attempt)
-            if session_attempt_comparison:
-                map_attempt_comparison = await compare_run('attempt', total_attempts, run_time,
-                                                           selected_map['best_attempt'])
-                if map_attempt_comparison:
-                    session_best_attempt = map_attempt_comparison
-                    selected_map['best_attempt'] = session_best_attempt
-                    logger.match(f"Stopped music after {run_time}\n"
-                                 f"{" " * 34}This is a new map best attempt! | Attempt #{attempts} lasted for {run_time} seconds\n"
-                                 f"{" " * 34}Matches: {match} | All Text: {text}")
-                    await database.execute('UPDATE sessions SET best_attempt = ? WHERE rowid = ?',
-                                           [json.dumps(session_best_attempt), run_id])
-                    await database.execute('UPDATE maps SET best_attempt = ? WHERE rowid = ?',
-                                           [json.dumps(session_best_attempt), selected_map['rowid']])
-                else:
-                    session_best_attempt = session_attempt_comparison
-                    logger.match(f"Stopped music after {run_time}\n"
-                                 f"{" " * 34}This is a new session best attempt! | Attempt #{total_attempts} lasted for {run_time} seconds\n"
-                                 f"{" " * 34}Map Best Attempt: {selected_map['best_attempt']['time']} seconds (S. Att. {selected_map['best_attempt']['attempt']})\n"
-                                 f"{" " * 34}Matches: {match} | All Text: {text}")
-                    await database.execute('UPDATE sessions SET best_attempt = ? WHERE rowid = ?',
-                                           [json.dumps(session_best_attempt), run_id])
+
+class Instance:
+    """
+    One game window tracked for one session: the map it's on, its own capture regions, pipeline and run detector, and
+    the run state (attempts, bests, when the current run started). The OCR pool, templates, writers and database are
+    the app's, so another window costs a capture and a turn on the OCR workers instead of another set of engines.
+
+    Instances on the same map share its `selected_map`, so the map's totals and bests count the runs of all of them.
+    """
+
+    def __init__(self, app: Companion, settings: dict, selected_map: dict, audio, metrics: Metrics):
+        self.app = app
+        self.name = settings['name']
+        self.hotkeys = settings['hotkeys']
+        self.music = settings['music']
+        self.label = f"[{self.name}] " if len(app.instances) > 1 else ""
+        self.selected_map = selected_map
+        self.audio = audio
+        self.metrics = metrics
+        self.screen_capture = app.screen_captures[self.name]
+        self.frame_gate = FrameGate(frame_change_threshold)
+        self.run_detector = RunDetector(trigger_regions, app.matcher, self.hotkeys)
+        # each instance gets an equal share of the CPU budget, so a window polling flat out during a countdown can't
+        # slow down the others
+        scheduler_settings = dict(app.config['scheduler'])
+        if scheduler_settings.get('cpu_budget'):
+            scheduler_settings['cpu_budget'] /= len(app.instances)
+        self.scheduler = PollingScheduler(self.run_detector, trigger_regions, **scheduler_settings)
+        self.pipeline = DetectionPipeline(self.screen_capture, app.ocr_pool, self.frame_gate, app.template_detector,
+                                          self.scheduler, unchanged_frame_sleep=unchanged_frame_sleep)
+        self.run_id = None
+        self.session_start = None
+        self.session_end = None
+        self.session_best_attempt = default_best_attempt.copy()
+        self.session_best_completion = default_best_completion.copy()
+        self.attempts = 0
+        self.completions = 0
+        self.attempt_number = 0  # the map's attempt number of the current run
+        self.run_start = None
+        self.text = ''
+        self.last_texts = None
+        self.frame_task = None
+        self.music_task = None
+
+    async def start(self):
+        # this is where the session is officially declared as 'started'
+        selected_map = self.selected_map
+        self.session_start = int(time.time())
+        self.run_id = await self.app.persistence.write('INSERT INTO sessions (map, session_start) VALUES(?, ?)',
+                                                       [selected_map['name'], self.session_start])
+
+        logger.info(f"{self.label}Started session {self.run_id} with map {selected_map['name']}\n"
+                    f"{" " * 33}Map Totals: {selected_map['total_attempts']} attempts, {selected_map['total_completions']} completions\n"
+                    f"{" " * 33}Map Best Attempt: {selected_map['best_attempt']['time']} seconds (Att. {selected_map['best_attempt']['attempt']})\n"
+                    f"{" " * 33}Map Best Completion: {selected_map['best_completion']['time']} seconds (Att. {selected_map['best_completion']['attempt']})")
+        self.pipeline.start()
+
+    def poll(self) -> asyncio.Task:
+        """The task waiting on this instance's next frame, started if there isn't one yet."""
+        if self.frame_task is None:
+            self.frame_task = asyncio.create_task(
+                self.pipeline.next_frame(after=self.run_detector.started_at if self.run_detector.running else None))
+        return self.frame_task
+
+    async def handle_frame(self, frame) -> bool:
+        """Matches the frame `poll()` waited on and records whatever it triggered. Returns True once the map is escaped."""
+        self.frame_task = None
+        metrics = self.metrics
+        self.text = " | ".join(frame.texts.values())
+        metrics.observe_frame(frame)
+        with metrics.time('match'):
+            event = await self.run_detector.check(frame)
+        metrics.observe('end_to_end', time.perf_counter() - frame.captured_perf + frame.timings['capture'])
+        if frame.texts != self.last_texts:
+            self.last_texts = frame.texts
+            logger.debug(f"{self.label}{time.perf_counter() - frame.captured_perf:.5f} seconds | "
+                         f"OCR'd: {', '.join(frame.ocr_regions) or 'none'} | Text: {self.text}",
+                         extra={'data': {'instance': self.name, 'captured_at': frame.captured_at,
+                                         'texts': frame.texts, 'ocr_regions': frame.ocr_regions,
+                                         'timings': frame.timings}})
+        return await self.handle_event(event, frame)
+
+    async def handle_key(self, key: str, pressed_at: float) -> bool:
+        """Handles one of this instance's hotkeys. Returns True once the map is escaped."""
+        return await self.handle_event(self.run_detector.key(key, pressed_at))
+
+    async def handle_event(self, event: dict, frame=None) -> bool:
+        if not event:
+            return False
+        if event['event'] == 'start':
+            self.start_run(event, frame)
+            return False
+        if event['event'] == 'stop':
+            await self.record_stop(event)
+            return False
+        await self.record_escape(event)
+        return True
+
+    def start_run(self, event: dict, frame):
+        detected_at = time.perf_counter()
+        # the run is timed from when the countdown was on screen, not from when OCR got around to reading it
+        self.run_start = event['time']
+        if event['countdown']:
+            starting = f", starting music in {max(self.run_start - time.time(), 0.0):.3f} seconds" if self.music else ""
+            logger.info(f"{self.label}Matched get ready: {event['digit'] or ''}{starting}")
+        if self.music:
+            # waiting for the countdown happens off the main loop, so the other instances keep being read meanwhile
+            self.music_task = asyncio.create_task(self.play_music(frame, detected_at))
+
+        selected_map = self.selected_map
+        self.attempts += 1
+        selected_map['total_attempts'] += 1
+        self.attempt_number = selected_map['total_attempts']
+        match = event['match']
+        logger.match(f"{self.label}Attempt {self.attempts} of {selected_map['name']}\n"
+                     f"{" " * 34}Matches: {match} | All Text: {self.text}",
+                     extra={'data': {'event': 'start', 'instance': self.name, 'map': selected_map['name'],
+                                     'session': self.run_id, 'attempt': self.attempt_number, 'time': self.run_start,
+                                     'digit': event['digit'], 'match': match}})
+
+    async def play_music(self, frame, detected_at: float):
+        audio, metrics = self.audio, self.metrics
+        late, played_at = await audio.play_at(self.run_start)
+        # both include the wait for the countdown to finish, which is logged alongside as the planned wait
+        capture_to_play = played_at - frame.captured_perf + frame.timings['capture']
+        detection_to_play = played_at - detected_at
+        planned_wait = self.run_start - audio.output_latency - frame.captured_at
+        metrics.observe('capture_to_play', capture_to_play)
+        metrics.observe('detection_to_play', detection_to_play)
+        metrics.observe('audio_late', late)
+        logger.debug(f"{self.label}Music started {capture_to_play:.3f} seconds after capture and "
+                     f"{detection_to_play:.3f} after detection, planned {planned_wait:.3f} after capture "
+                     f"(output latency {audio.output_latency * 1000:.1f}ms)",
+                     extra={'data': {'instance': self.name, 'capture_to_play': capture_to_play,
+                                     'detection_to_play': detection_to_play, 'planned_wait': planned_wait,
+                                     'late': late, 'output_latency': audio.output_latency}})
+
+    def stop_music(self):
+        if self.music_task:
+            self.music_task.cancel()
+            self.music_task = None
+        self.audio.stop()
+
+    async def record_stop(self, event: dict):
+        record_start = time.perf_counter()
+        self.stop_music()
+        persistence, selected_map, run_id, label = self.app.persistence, self.selected_map, self.run_id, self.label
+        attempts, total_attempts, text = self.attempts, self.attempt_number, self.text
+        match = event['match']
+        run_time = round(event['time'] - self.run_start, 3)
+
+        session_attempt_comparison = await compare_run('attempt', attempts, run_time, self.session_best_attempt)
+        if session_attempt_comparison:
+            map_attempt_comparison = await compare_run('attempt', total_attempts, run_time,
+                                                       selected_map['best_attempt'])
+            if map_attempt_comparison:
+                self.session_best_attempt = map_attempt_comparison
+                selected_map['best_attempt'] = self.session_best_attempt
+                logger.match(f"{label}Stopped music after {run_time}\n"
+                             f"{" " * 34}This is a new map best attempt! | Attempt #{attempts} lasted for {run_time} seconds\n"
+                             f"{" " * 34}Matches: {match} | All Text: {text}")
+                persistence.update('sessions', run_id, **best_columns('attempt', self.session_best_attempt))
+                persistence.update('maps', selected_map['id'], **best_columns('attempt', self.session_best_attempt))
             else:
-                logger.match(f"Stopped music after {run_time}\n"
-                             f"{" " * 34}Map Best Attempt: {selected_map['best_attempt']['time']} seconds (Att. {selected_map['best_attempt']['attempt']})\n"
-                             f"{" " * 34}Session Best Attempt: {session_best_attempt['time']} seconds (S. Att. {session_best_attempt['attempt']})\n"
-                             f"{" " * 34}All Text: {text} | Matches: {match}")
-
-            await database.execute('UPDATE sessions SET total_attempts = ? WHERE rowid = ?',
-                                   [attempts, run_id])
-            await database.execute('UPDATE maps SET total_attempts = ? WHERE rowid = ?',
-                                   [total_attempts, selected_map['rowid']])
-            await database.commit()
-        elif (keyboard.is_pressed('c') or re.search(r"(\d+)/(\d+) escaped", text)) and running:
-            run_time = round(time.time() - run_start, 3)
-            completions += 1
-            total_attempts = selected_map['total_attempts'] + attempts
-            total_completions = selected_map['total_completions'] + completions
-            ImageGrab.grab().save(
-                f'images/completions/{await slugify(selected_map["name"])}_{int(time.time())}_completion_{total_completions}.png',
-                "PNG")
-
-            session_completion_comparison = await compare_run('completion', total_attempts, run_time,
-                                                              session_best_completion)
-            if session_completion_comparison:
-                map_completion_comparison = await compare_run('completion', total_attempts, run_time,
-                                                              selected_map['best_completion'])
-                if map_completion_comparison:
-                    session_best_completion = map_completion_comparison
-                    logger.success(
-                        f"Escaped map {selected_map['name']} after {attempts} attempts with a time of {run_time} seconds\n"
-                        f"{" " * 37}This is your new map record! | Completions: {selected_map['total_completions'] + completions} ({completions} today)\n"
-                        f"{" " * 37}All Text: {text}")
-                    await database.execute('UPDATE sessions SET best_completion = ? WHERE rowid = ?',
-                                           [json.dumps(session_best_completion), run_id])
-                    await database.execute('UPDATE maps SET best_completion = ? WHERE rowid = ?',
-                                           [json.dumps(session_best_completion), selected_map['rowid']])
-                else:
-                    session_best_completion = session_completion_comparison
-                    logger.success(
-                        f"Escaped map {selected_map['name']} after {attempts} attempts with a time of {run_time} seconds\n"
-                        f"{" " * 37}This is a new session record! | Completions: {selected_map['total_completions'] + completions} ({completions} today)\n"
-                        f"{" " * 37}Map Best Completion: {selected_map['best_completion']['time']} seconds (Att. {selected_map['best_completion']['attempt']})\n"
-                        f"{" " * 37}All Text: {text}")
-                    await database.execute('UPDATE sessions SET best_completion = ? WHERE rowid = ?',
-                                           [json.dumps(session_best_completion), run_id])
+                self.session_best_attempt = session_attempt_comparison
+                logger.match(f"{label}Stopped music after {run_time}\n"
+                             f"{" " * 34}This is a new session best attempt! | Attempt #{total_attempts} lasted for {run_time} seconds\n"
+                             f"{" " * 34}Map Best Attempt: {selected_map['best_attempt']['time']} seconds (S. Att. {selected_map['best_attempt']['attempt']})\n"
+                             f"{" " * 34}Matches: {match} | All Text: {text}")
+                persistence.update('sessions', run_id, **best_columns('attempt', self.session_best_attempt))
+        else:
+            logger.match(f"{label}Stopped music after {run_time}\n"
+                         f"{" " * 34}Map Best Attempt: {selected_map['best_attempt']['time']} seconds (Att. {selected_map['best_attempt']['attempt']})\n"
+                         f"{" " * 34}Session Best Attempt: {self.session_best_attempt['time']} seconds (S. Att. {self.session_best_attempt['attempt']})\n"
+                         f"{" " * 34}All Text: {text} | Matches: {match}")
+
+        persistence.insert('attempts', map=selected_map['name'], session=run_id, attempt=total_attempts,
+                           start=self.run_start, duration=run_time, outcome='stopped', matched=match)
+        logger.debug(f"{label}Recorded attempt {total_attempts}", extra={'data': {
+            'event': 'stop', 'instance': self.name, 'map': selected_map['name'], 'session': run_id,
+            'attempt': total_attempts, 'time': event['time'], 'duration': run_time, 'match': match,
+            'hotkey': event['hotkey']}})
+        persistence.update('sessions', run_id, total_attempts=attempts)
+        persistence.update('maps', selected_map['id'], total_attempts=selected_map['total_attempts'])
+        self.metrics.observe('record_run', time.perf_counter() - record_start)
+
+    async def record_escape(self, event: dict):
+        record_start = time.perf_counter()
+        persistence, selected_map, run_id, label = self.app.persistence, self.selected_map, self.run_id, self.label
+        attempts, total_attempts, text = self.attempts, self.attempt_number, self.text
+        run_time = round(event['time'] - self.run_start, 3)
+        self.completions += 1
+        completions = self.completions
+        selected_map['total_completions'] += 1
+        total_completions = selected_map['total_completions']
+        screenshot_settings = self.app.config['screenshots']
+        await self.app.screenshot_writer.capture(
+            f'{await slugify(selected_map["name"])}_{int(time.time())}_completion_{total_completions}',
+            self.screen_capture.boxes.get(screenshot_settings['crop_region']) or self.screen_capture.window)
+
+        session_completion_comparison = await compare_run('completion', total_attempts, run_time,
+                                                          self.session_best_completion)
+        if session_completion_comparison:
+            map_completion_comparison = await compare_run('completion', total_attempts, run_time,
+                                                          selected_map['best_completion'])
+            if map_completion_comparison:
+                self.session_best_completion = map_completion_comparison
+                selected_map['best_completion'] = self.session_best_completion
+                logger.success(
+                    f"{label}Escaped map {selected_map['name']} after {attempts} attempts with a time of {run_time} seconds\n"
+                    f"{" " * 37}This is your new map record! | Completions: {total_completions} ({completions} today)\n"
+                    f"{" " * 37}All Text: {text}")
+                persistence.update('sessions', run_id, **best_columns('completion', self.session_best_completion))
+                persistence.update('maps', selected_map['id'],
+                                   **best_columns('completion', self.session_best_completion))
             else:
+                self.session_best_completion = session_completion_comparison
                 logger.success(
-                    f"Escaped map {selected_map['name']} after {attempts} attempts with a time of {run_time} seconds\n"
+                    f"{label}Escaped map {selected_map['name']} after {attempts} attempts with a time of {run_time} seconds\n"
+                    f"{" " * 37}This is a new session record! | Completions: {total_completions} ({completions} today)\n"
                     f"{" " * 37}Map Best Completion: {selected_map['best_completion']['time']} seconds (Att. {selected_map['best_completion']['attempt']})\n"
-                    f"{" " * 37}Session Best Completion: {session_best_completion['time']} seconds (Att. {session_best_completion['attempt']})\n"
                     f"{" " * 37}All Text: {text}")
+                persistence.update('sessions', run_id, **best_columns('completion', self.session_best_completion))
+        else:
+            logger.success(
+                f"{label}Escaped map {selected_map['name']} after {attempts} attempts with a time of {run_time} seconds\n"
+                f"{" " * 37}Map Best Completion: {selected_map['best_completion']['time']} seconds (Att. {selected_map['best_completion']['attempt']})\n"
+                f"{" " * 37}Session Best Completion: {self.session_best_completion['time']} seconds (Att. {self.session_best_completion['attempt']})\n"
+                f"{" " * 37}All Text: {text}")
+
+        persistence.insert('attempts', map=selected_map['name'], session=run_id, attempt=total_attempts,
+                           start=self.run_start, duration=run_time, outcome='escaped', matched=event['match'])
+        logger.debug(f"{label}Recorded completion {total_completions}", extra={'data': {
+            'event': 'escape', 'instance': self.name, 'map': selected_map['name'], 'session': run_id,
+            'attempt': total_attempts, 'time': event['time'], 'duration': run_time, 'match': event['match'],
+            'hotkey': event['hotkey']}})
+        persistence.update('sessions', run_id, total_attempts=attempts, total_completions=completions)
+        persistence.update('maps', selected_map['id'], total_attempts=selected_map['total_attempts'],
+                           total_completions=total_completions)
+        self.metrics.observe('record_run', time.perf_counter() - record_start)
+
+    async def stop(self):
+        """Stops watching the window. The song of an escaped run keeps playing."""
+        if self.frame_task:
+            self.frame_task.cancel()
+            self.frame_task = None
+        await self.pipeline.stop()
+
+    async def close(self):
+        """Stops watching the window and ends the session."""
+        await self.stop()
+        self.stop_music()
+        if self.run_id is not None and self.session_end is None:
+            self.session_end = int(time.time())
+            self.app.persistence.update('sessions', self.run_id, session_end=self.session_end)
 
-            await database.execute('UPDATE sessions SET total_attempts = ?, total_completions = ? WHERE rowid = ?',
-                                   [attempts, completions, run_id])
-            await database.execute('UPDATE maps SET total_attempts = ?, total_completions = ? WHERE rowid = ?',
-                                   [total_attempts,
-                                    total_completions, selected_map['rowid']])
-            await database.commit()
-            break
-        elif keyboard.is_pressed('k') or keyboard.is_pressed('m'):
-            pygame.mixer.music.stop()
-            break
-        perf_end = time.perf_counter()
-        logger.debug(f"{perf_end - perf_start:.5f} seconds | Text: {text}")
-
-    while pygame.mixer.music.get_busy():
-        if keyboard.is_pressed('k'):
-            pygame.mixer.music.stop()
-        await asyncio.sleep(1)
-
-    session_end = int(time.time())
-    await database.execute('UPDATE sessions SET session_end = ? WHERE rowid = ?',
-                           [session_end, run_id])
-    await database.close()
-    logger.info(f'Session ended! Duration: {session_end - session_start} seconds')
-
-    if keyboard.is_pressed('m'):
-        return await main()
 
+async def main():
+    # git_hash = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD']).decode('ascii').strip()
+    # logger.info(f"FE2 Companion by pinheadtf2 [{git_hash}]")
+    logger.info(f"FE2 Companion by pinheadtf2")
+
+    Path('music').mkdir(exist_ok=True)
+    app = Companion()
+    try:
+        await app.start()
+        while await run_session(app):
+            logger.info("Switching maps")
+    finally:
+        await app.close()
     logger.bye("See ya!")
-    return
+
+
+async def run_session(app: Companion) -> bool:
+    """
+    Tracks a map in every instance until each of them is escaped or k/m is pressed. Returns True to pick other maps.
+    """
+    database = app.database
+    maps = {}
+    selected_maps = []
+    for settings in app.instances:
+        if len(app.instances) > 1:
+            logger.info(f"Pick the map played in {settings['name']}")
+        selected_map = await select_map()
+        if selected_map['song'] and not await song_available(database, selected_map['song']):
+            logger.warning(f"Song {selected_map['song']} of {selected_map['name']} isn't in the music folder anymore, "
+                           f"pick another one")
+            selected_map['song'] = await find_select_music()
+            await app.persistence.write('UPDATE maps SET song = ? WHERE id = ?',
+                                        [selected_map['song'], selected_map['id']])
+        selected_maps.append(maps.setdefault(selected_map['id'], selected_map))
+
+    await app.ready()
+    audio, hotkeys, persistence = app.audio, app.hotkeys, app.persistence
+    music_map = next((selected_map for settings, selected_map in zip(app.instances, selected_maps)
+                      if settings['music']), None)
+    if music_map:
+        volume = 0
+        song = 'music/Hyperspace - V2 - luxTypes.mp3'  # played silently when the map has no song, to time the session
+        if music_map['song']:
+            play_song_query = input(f"Play map's song {music_map['song']} (Y/n)?")
+            if len(play_song_query) == 0 or play_song_query[0].lower() == 'y':
+                song = music_map['song']
+        # the song is decoded while the volume prompt is up
+        song_loaded = asyncio.get_running_loop().run_in_executor(None, audio.load, song)
+        if song == music_map['song']:
+            volume = await choose_volume()
+        await song_loaded
+        audio.set_volume(volume)
+        logger.info(f"Initialized music player with song {music_map['song']} at volume {volume}")
+
+    metrics = Metrics()
+    instances = [Instance(app, settings, selected_map, audio if settings['music'] else NullAudio(), metrics)
+                 for settings, selected_map in zip(app.instances, selected_maps)]
+    key_owners = {key: instance for instance in instances for key in instance.hotkeys}
+    active = list(instances)
+    restart = False
+    key_task = None
+    try:
+        for instance in instances:
+            await instance.start()
+        # keys typed into the prompts above aren't hotkeys
+        hotkeys.clear()
+        # frames of every instance and key presses are waited on together, so whichever comes first is handled first
+        key_task = asyncio.create_task(hotkeys.get())
+        while active:
+            await asyncio.wait([*(instance.poll() for instance in active), key_task],
+                               return_when=asyncio.FIRST_COMPLETED)
+            finished = []
+            if key_task.done():
+                key, pressed_at = key_task.result()
+                key_task = asyncio.create_task(hotkeys.get())
+                if key in ('k', 'm'):
+                    audio.stop()
+                    restart = key == 'm'
+                    break
+                instance = key_owners.get(key)
+                if instance in active and await instance.handle_key(key, pressed_at):
+                    finished.append(instance)
+            for instance in active:
+                if instance not in finished and instance.frame_task.done():
+                    if await instance.handle_frame(instance.frame_task.result()):
+                        finished.append(instance)
+            for instance in finished:
+                active.remove(instance)
+                await instance.stop()
+            if metrics.summary_due(metrics_interval):
+                logger.info(f"Stage timings: {metrics.summary()}")
+                if metrics_path:
+                    metrics.write(metrics_path)
+
+        key_task.cancel()
+        for instance in instances:
+            await instance.stop()
+        # let the song finish, k stops it and m stops it and picks other maps
+        while audio.get_busy():
+            pressed = await hotkeys.get(timeout=0.25)
+            if pressed and pressed[0] in ('k', 'm'):
+                audio.stop()
+                restart = restart or pressed[0] == 'm'
+    finally:
+        # also runs on Ctrl+C, so the last attempts still make it into the database
+        if key_task:
+            key_task.cancel()
+        for instance in instances:
+            await instance.close()
+        audio.stop()
+        await persistence.flush()
+    for instance in instances:
+        logger.info(f"{instance.label}Session ended! Duration: {instance.session_end - instance.session_start} seconds")
+        logger.debug(f"{instance.label}Skipped OCR on {instance.frame_gate.skipped} of {instance.frame_gate.frames} "
+                     f"frames with no changes, dropped {instance.pipeline.dropped} stale frames")
+    logger.info(f"Stage timings: {metrics.summary()}")
+    metrics.set_counter('frames', sum(instance.frame_gate.frames for instance in instances))
+    metrics.set_counter('frames_unchanged', sum(instance.frame_gate.skipped for instance in instances))
+    metrics.set_counter('frames_dropped', sum(instance.pipeline.dropped for instance in instances))
+    if metrics_path:
+        metrics.write(metrics_path)
+    return restart
+
+
+async def run_replay(args):
+    config = load_config(config_name)
+    source = ReplaySource(args.path, config['regions'], config['capture']['reference_resolution'], args.realtime)
+    logger.info(f"Replaying {len(source.frames)} frames from {args.path}"
+                f"{' in real time' if args.realtime else ''}")
+    ocr_pool = OCRPool(config['regions'], ocr_backend, 'eng', tesseract_cmd)
+    template_detector = TemplateDetector(trigger_regions, templates_path, template_threshold)
+    run_detector = RunDetector(trigger_regions, PhraseMatcher(trigger_phrases))
+    # a real time replay polls like a live session, otherwise every frame is read as fast as possible
+    scheduler = PollingScheduler(run_detector, trigger_regions, **config['scheduler']) if args.realtime else None
+    pipeline = DetectionPipeline(source, ocr_pool, FrameGate(frame_change_threshold), template_detector, scheduler,
+                                 unchanged_frame_sleep=unchanged_frame_sleep if args.realtime else 0,
+                                 drop_stale=args.realtime)
+
+    def log_event(frame, event, match_time):
+        if event:
+            logger.match(f"{event['event'].capitalize()} at {event['time']:.3f} | Matches: {event['match']} | "
+                         f"All Text: {' | '.join(frame.texts.values())}")
+
+    try:
+        if args.command == 'bench':
+            metrics = Metrics()
+            report = await benchmark(pipeline, run_detector, source.labels, args.tolerance, metrics)
+            logger.info(f"Benchmark of {args.path} with OCR engine {ocr_pool.name}")
+            print(report)
+            if args.metrics:
+                metrics.write(args.metrics)
+        else:
+            events = await replay(pipeline, run_detector, log_event)
+            logger.info(f"Replay finished with {len(events)} events")
+    finally:
+        ocr_pool.close()
+        source.close()
+
+
+async def run_stats(args):
+    if not Path(database_name).exists():
+        logger.error(f"No database found at {database_name}, track a session first")
+        return
+    database = await connect_database(database_name)
+    try:
+        if args.map:
+            map_names = [args.map]
+        else:
+            async with database.execute('SELECT name FROM maps ORDER BY name') as cursor:
+                map_names = [row[0] for row in await cursor.fetchall()]
+        all_stats = [await map_stats(database, map_name, args.sessions) for map_name in map_names]
+    finally:
+        await database.close()
+
+    for stats in all_stats:
+        print(format_stats(stats))
+    if args.json:
+        Path(args.json).write_text(json.dumps(all_stats, indent=2))
+        logger.info(f"Wrote stats for {len(all_stats)} maps to {args.json}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="FE2 Companion. Run without a command to start tracking.")
+    parser.add_argument('--metrics', metavar='FILE', help="write stage timings to FILE in Prometheus text format")
+    subparsers = parser.add_subparsers(dest='command')
+
+    record_parser = subparsers.add_parser('record', help="record full-screen frames for replays and benchmarks")
+    record_parser.add_argument('path', help="directory to save frames to")
+    record_parser.add_argument('--interval', type=float, default=0.1, help="seconds between frames")
+    record_parser.add_argument('--duration', type=float, default=None, help="seconds to record for (default: until Ctrl+C)")
+
+    for command, description in (('replay', "run a recording through the detector and log what it finds"),
+                                 ('bench', "benchmark the detector against a recording and its labels.json")):
+        command_parser = subparsers.add_parser(command, help=description)
+        command_parser.add_argument('path', help="directory or .zip of frames named by capture time")
+        command_parser.add_argument('--realtime', action='store_true',
+                                    help="pace frames by their timestamps and drop the ones the detector can't keep up with")
+        if command == 'bench':
+            command_parser.add_argument('--tolerance', type=float, default=5.0,
+                                        help="seconds a detection can be off from its label and still count")
+
+    stats_parser = subparsers.add_parser('stats', help="print run statistics for a map, or every map")
+    stats_parser.add_argument('map', nargs='?', help="name of the map (default: every map)")
+    stats_parser.add_argument('--sessions', type=int, default=10, help="how many recent sessions to show trends for")
+    stats_parser.add_argument('--json', metavar='FILE', help="also export the statistics to FILE as JSON")
+    return parser.parse_args()
 
 
 if __name__ == '__main__':
-    asyncio.run(main())
+    args = parse_args()
+    metrics_path = args.metrics
+    if args.command == 'record':
+        record_frames(args.path, args.interval, args.duration)
+    elif args.command in ('replay', 'bench'):
+        asyncio.run(run_replay(args))
+    elif args.command == 'stats':
+        asyncio.run(run_stats(args))
+    else:
+        asyncio.run(main())
     exit(0)
@@ -0,0 +1,174 @@
+import asyncio
+import contextlib
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# how late a start can be before the song is skipped ahead to stay in sync, in seconds
+late_tolerance = 0.03
+# bytes of decoded song copied at load to time how fast the rest of a song can be cut out for a late start
+copy_sample_bytes = 8 * 1024 * 1024
+
+
+def spin_until(deadline: float):
+    """Busy-waits until `deadline` (a time.perf_counter() value)."""
+    while time.perf_counter() < deadline:
+        pass
+
+
+async def run_at(when: float, function, spin: float = 0.02):
+    """
+    Calls `function()` at `when` (a time.time() value) and returns what it returned. asyncio.sleep is only as
+    accurate as the OS timer (about 15ms on Windows), so the last `spin` seconds are waited out on the high resolution
+    performance counter, on a worker thread that then makes the call, so neither blocks the event loop.
+    """
+    deadline = time.perf_counter() + (when - time.time())
+    remaining = deadline - time.perf_counter()
+    if remaining > spin:
+        await asyncio.sleep(remaining - spin)
+
+    def call():
+        spin_until(deadline)
+        return function()
+
+    return await asyncio.to_thread(call)
+
+
+class PygameAudio:
+    """
+    Plays the map's song through pygame's mixer.
+
+    With `preload`, the song is decoded into memory when it's loaded, so starting it only hands a buffer to the mixer
+    instead of opening and decoding the file. `buffer` is the mixer's buffer size in samples: smaller buffers are heard
+    sooner but can crackle on a busy machine. Songs pygame can't decode up front are streamed from disk instead.
+
+    `output_latency` is how long after `play()` the song is actually heard: the mixer buffer plus `latency_offset`,
+    whatever else this machine's audio output adds. Nothing here can hear the speakers, so that's set by ear.
+    """
+
+    def __init__(self, frequency: int = 44100, buffer: int = 512, preload: bool = True, latency_offset: float = 0.0):
+        with contextlib.redirect_stdout(None):
+            import pygame
+        self.pygame = pygame
+        self.music = pygame.mixer.music
+        pygame.mixer.pre_init(frequency=frequency, buffer=buffer)
+        pygame.mixer.init()
+        self.frequency, sample_format, channels = pygame.mixer.get_init()
+        self.frame_bytes = abs(sample_format) // 8 * channels
+        self.output_latency = buffer / self.frequency + latency_offset
+        self.preload = preload
+        self.sound = None
+        self.samples = None
+        self.copy_rate = None  # bytes per second a Sound is built from decoded samples at
+        self.channel = None
+        self.volume = 1.0
+        self.stops = 0  # a start that was already on its way when the song was stopped doesn't play it
+
+    def load(self, path: str):
+        self.sound = None
+        self.samples = None
+        if self.preload:
+            try:
+                self.sound = self.pygame.mixer.Sound(path)
+                self.sound.set_volume(self.volume)
+            except self.pygame.error as e:
+                logger.warning(f"Couldn't preload {path}, streaming it instead: {e}")
+        if self.sound:
+            # a late start cuts the rest of the song into a new Sound. the decoded samples are taken out now, and the
+            # copy is timed so a late start can skip ahead by however long its own copy is going to take
+            self.samples = memoryview(self.sound.get_raw())
+            copy_start = time.perf_counter()
+            self.pygame.mixer.Sound(buffer=self.samples[:copy_sample_bytes])
+            self.copy_rate = min(len(self.samples), copy_sample_bytes) / max(time.perf_counter() - copy_start, 1e-6)
+        if self.sound is None:
+            self.music.load(path)
+
+    def set_volume(self, volume: float):
+        self.volume = volume
+        if self.sound:
+            self.sound.set_volume(volume)
+        self.music.set_volume(volume)
+
+    def play(self, offset: float = 0.0):
+        """Starts the song `offset` seconds in."""
+        if self.sound is None:
+            try:
+                self.music.play(start=offset)
+            except self.pygame.error:  # not every format can start partway through
+                self.music.play()
+            return
+        sound = self.sound
+        if offset > 0:
+            start = int(offset * self.frequency) * self.frame_bytes
+            # building the Sound copies everything after `start`, and the song keeps going meanwhile
+            offset += max(len(self.samples) - start, 0) / self.copy_rate
+            start = int(offset * self.frequency) * self.frame_bytes
+            if start >= len(self.samples):
+                return
+            sound = self.pygame.mixer.Sound(buffer=self.samples[start:])
+            sound.set_volume(self.volume)
+        self.channel = sound.play()
+
+    async def play_at(self, when: float) -> tuple:
+        """
+        Starts the song so it's heard at `when` (a time.time() value). If that's already passed, the song starts
+        partway through, where it would be by now, cut from the decoded song on the worker thread. Returns how late
+        `play()` was called in seconds, and the time.perf_counter() it was called at.
+        """
+        target = when - self.output_latency
+        stops = self.stops
+
+        def start():
+            late = time.time() - target
+            played_at = time.perf_counter()
+            if self.stops == stops:
+                self.play(late if late > late_tolerance else 0.0)
+            return late, played_at
+
+        return await run_at(target, start)
+
+    def stop(self):
+        self.stops += 1
+        if self.channel:
+            self.channel.stop()
+            self.channel = None
+        self.music.stop()
+
+    def get_busy(self) -> bool:
+        return bool(self.channel and self.channel.get_busy()) or self.music.get_busy()
+
+
+class NullAudio:
+    """Audio sink for replays and benchmarks. Plays nothing, but records when it was told to play and stop."""
+
+    output_latency = 0.0
+
+    def __init__(self):
+        self.events = []
+        self.playing = False
+
+    def load(self, path: str):
+        self.events.append(('load', time.time()))
+
+    def set_volume(self, volume: float):
+        pass
+
+    def play(self, offset: float = 0.0):
+        self.playing = True
+        self.events.append(('play', time.time()))
+
+    async def play_at(self, when: float) -> tuple:
+        def start():
+            late, played_at = time.time() - when, time.perf_counter()
+            self.play()
+            return late, played_at
+
+        return await run_at(when, start)
+
+    def stop(self):
+        self.playing = False
+        self.events.append(('stop', time.time()))
+
+    def get_busy(self) -> bool:
+        return False
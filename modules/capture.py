@@ -0,0 +1,71 @@
+import logging
+import time
+
+import numpy as np
+from PIL import ImageGrab
+
+logger = logging.getLogger(__name__)
+
+
+def scale_bbox(bbox, reference_resolution, screen_size):
+    x_scale = screen_size[0] / reference_resolution[0]
+    y_scale = screen_size[1] / reference_resolution[1]
+    left, top, right, bottom = bbox
+    return (round(left * x_scale), round(top * y_scale),
+            min(round(right * x_scale), screen_size[0]), min(round(bottom * y_scale), screen_size[1]))
+
+
+class ScreenCapture:
+    """
+    Grabs the whole screen once per tick and hands out every region as a NumPy view into that one frame,
+    so all regions come from the same instant and no per-region copy is made.
+
+    Region bboxes are given for `reference_resolution` and rescaled whenever the captured screen size changes.
+    With a `window` (left, top, right, bottom) only that part of the screen is captured, and the regions are scaled to
+    the window's size instead, so several game windows side by side each get their own set of regions. `boxes` are
+    always in screen coordinates.
+    """
+
+    def __init__(self, regions: dict, reference_resolution=(1920, 1080), window=None):
+        self.regions = regions
+        self.reference_resolution = tuple(reference_resolution)
+        self.window = tuple(window) if window else None
+        self.origin = self.window[:2] if self.window else (0, 0)
+        self.screen_size = None
+        self.boxes = {}
+
+    def _scale_regions(self, screen_size):
+        self.screen_size = screen_size
+        x, y = self.origin
+        self.boxes = {}
+        for name, region in self.regions.items():
+            left, top, right, bottom = scale_bbox(region['bbox'], self.reference_resolution, screen_size)
+            self.boxes[name] = (left + x, top + y, right + x, bottom + y)
+        if screen_size != self.reference_resolution:
+            logger.info(f"Scaled capture regions from {self.reference_resolution[0]}x{self.reference_resolution[1]} "
+                        f"to {screen_size[0]}x{screen_size[1]}")
+
+    def crop(self, frame: np.ndarray, regions: list = None) -> dict:
+        screen_size = (frame.shape[1], frame.shape[0])
+        if screen_size != self.screen_size:
+            self._scale_regions(screen_size)
+        x, y = self.origin
+        return {name: frame[top - y:bottom - y, left - x:right - x]
+                for name, (left, top, right, bottom) in self.boxes.items() if regions is None or name in regions}
+
+    def grab(self, regions: list = None):
+        """
+        Returns (capture time, {region name: RGB array view}) cropped from a single screen capture.
+        With `regions`, only the area covering those regions is captured.
+        """
+        if regions is None or self.screen_size is None:
+            frame = np.asarray(ImageGrab.grab(bbox=self.window))
+            return time.time(), self.crop(frame, regions)
+
+        boxes = [self.boxes[name] for name in regions]
+        left, top = min(box[0] for box in boxes), min(box[1] for box in boxes)
+        right, bottom = max(box[2] for box in boxes), max(box[3] for box in boxes)
+        frame = np.asarray(ImageGrab.grab(bbox=(left, top, right, bottom)))
+        captured_at = time.time()
+        return captured_at, {name: frame[box[1] - top:box[3] - top, box[0] - left:box[2] - left]
+                             for name, box in zip(regions, boxes)}
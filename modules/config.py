@@ -0,0 +1,103 @@
+import copy
+import json
+from pathlib import Path
+
+# region bboxes are (left, top, right, bottom) on a screen of `reference_resolution`,
+# and get scaled to the real monitor size when captured. each region is OCR'd on its own as a single line (psm 7)
+# or block (psm 6) after thresholding out everything but white text (see modules/preprocess.py, set 'preprocess'
+# to null in config.json to OCR a region's raw capture instead)
+DEFAULT_CONFIG = {
+    'capture': {
+        'reference_resolution': [1920, 1080],
+    },
+    # seconds between grabs in each run state (see modules/scheduler.py), and the share of one core
+    # that capture and OCR may use
+    'scheduler': {
+        'idle_interval': 0.25,
+        'armed_interval': 0.0,
+        'running_interval': 0.1,
+        'armed_timeout': 5.0,
+        'cpu_budget': 0.5,
+    },
+    # mixer sample rate and buffer size (in samples, smaller starts the music sooner), whether songs are decoded into
+    # memory up front, and extra seconds to start early for this machine's audio output (see the latency in the log)
+    'audio': {
+        'frequency': 44100,
+        'buffer': 512,
+        'preload': True,
+        'latency_offset': 0.0,
+    },
+    # completion screenshots. format is png, webp or jpeg, crop_region saves just that capture region instead of
+    # the whole screen, thumbnail is a [width, height] for an extra small copy, and keep/max_age_days delete old ones.
+    # both are off by default, since they prune every screenshot in the folder, including ones from older versions
+    'screenshots': {
+        'format': 'png',
+        'compress_level': 1,
+        'quality': 80,
+        'crop_region': None,
+        'thumbnail': None,
+        'keep': None,
+        'max_age_days': None,
+    },
+    # game windows tracked side by side in one process, each with its own map and session. window is the game's
+    # [left, top, right, bottom] on screen (null for the whole screen) and the regions are scaled to fit it, music marks
+    # the one instance whose runs play the map's song, and hotkeys maps keys to 'stop' or 'escape' for its runs
+    'instances': [
+        {'name': 'main', 'window': None, 'music': True, 'hotkeys': {'g': 'stop', 'c': 'escape'}},
+    ],
+    'regions': {
+        'ready': {'bbox': [320, 850, 1000, 1000], 'psm': 7, 'whitelist': 'GETREADYgetready:.0123456789',
+                  'preprocess': {'threshold': 200, 'text_height': 32}},
+        'notifications': {'bbox': [600, 0, 1300, 300], 'psm': 6, 'whitelist': None,
+                          'preprocess': {'threshold': 200}},
+        'rescue': {'bbox': [700, 870, 1250, 990], 'psm': 7, 'whitelist': None,
+                   'preprocess': {'threshold': 200, 'text_height': 32}},
+    },
+}
+
+
+def merge_config(base: dict, override: dict) -> dict:
+    merged = copy.deepcopy(base)
+    for key, value in override.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge_config(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def load_config(config_name: str) -> dict:
+    """
+    Loads `config_name` on top of the defaults. The file is optional and only needs the keys being changed, e.g.
+    {"regions": {"ready": {"bbox": [300, 840, 1000, 1000]}}}
+    """
+    path = Path(config_name)
+    if not path.exists():
+        return copy.deepcopy(DEFAULT_CONFIG)
+    with path.open(encoding='utf-8') as file:
+        return merge_config(DEFAULT_CONFIG, json.load(file))
+
+
+def instance_settings(config: dict) -> list:
+    """
+    The instances from `config`, with whatever an entry leaves out filled in: a window covering the whole screen, no
+    music and no hotkeys. Raises ValueError if two instances share a name or a hotkey, or more than one plays music.
+    """
+    instances = []
+    for number, instance in enumerate(config['instances'], 1):
+        instances.append({'name': f'instance {number}', 'window': None, 'music': False, 'hotkeys': {}, **instance})
+
+    names = [instance['name'] for instance in instances]
+    if not instances or len(set(names)) != len(names):
+        raise ValueError(f"Instances need unique names, got {names}")
+    if sum(bool(instance['music']) for instance in instances) > 1:
+        raise ValueError("Only one instance can play music")
+    claimed = {'k', 'm'}  # end the session for every instance
+    for instance in instances:
+        for key, action in instance['hotkeys'].items():
+            if action not in ('stop', 'escape'):
+                raise ValueError(f"Hotkey {key} of {instance['name']} has to 'stop' or 'escape', not '{action}'")
+            if key in claimed:
+                raise ValueError(f"Hotkey {key} of {instance['name']} is already taken")
+            claimed.add(key)
+    return instances
@@ -1,29 +1,157 @@
+import json
+import logging
+
 import aiosqlite
 
+from modules.music import create_music_table
+from modules.stats import create_stats_tables
+
+logger = logging.getLogger(__name__)
+
+# what a map or session starts out with, and what unreadable legacy bests fall back to
+default_best_attempt = {"attempt": 0, "time": 0}
+default_best_completion = {"attempt": 0, "time": 999999}
+
+
+async def create_tables(database):
+    await database.execute('''
+        CREATE TABLE IF NOT EXISTS maps (
+            name TEXT not null primary key,
+            song TEXT,
+            total_attempts integer NOT NULL,
+            total_completions integer NOT NULL,
+            best_attempt text NOT NULL,
+            best_completion text NOT NULL
+        )
+    ''')
+
+    await database.execute('''
+        CREATE TABLE IF NOT EXISTS sessions (
+            map text not null,
+            session_start integer NOT NULL,
+            session_end integer,
+            total_attempts integer NOT NULL,
+            total_completions integer NOT NULL,
+            best_attempt text NOT NULL,
+            best_completion text NOT NULL,
+            FOREIGN KEY (map) REFERENCES maps (name)
+            )
+    ''')
+
+
+def parse_best(text: str, default: dict) -> dict:
+    # sessions used to be inserted with str(dict), which is JSON with single quotes
+    try:
+        best = json.loads(text.replace("'", '"'))
+        return {'attempt': int(best['attempt']), 'time': float(best['time'])}
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return default.copy()
+
+
+async def add_attempts_and_typed_bests(database):
+    """
+    Rebuilds maps and sessions with an explicit id and the JSON bests split into typed columns, and adds the attempts
+    table. Ids are copied over, so anything holding on to a rowid still finds the same row.
+    """
+    await database.execute(f'''
+        CREATE TABLE maps_new (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE,
+            song TEXT,
+            total_attempts INTEGER NOT NULL DEFAULT 0,
+            total_completions INTEGER NOT NULL DEFAULT 0,
+            best_attempt_time REAL NOT NULL DEFAULT {default_best_attempt['time']},
+            best_attempt_number INTEGER NOT NULL DEFAULT {default_best_attempt['attempt']},
+            best_completion_time REAL NOT NULL DEFAULT {default_best_completion['time']},
+            best_completion_number INTEGER NOT NULL DEFAULT {default_best_completion['attempt']}
+        )
+    ''')
+    await database.execute(f'''
+        CREATE TABLE sessions_new (
+            id INTEGER PRIMARY KEY,
+            map TEXT NOT NULL REFERENCES maps (name),
+            session_start INTEGER NOT NULL,
+            session_end INTEGER,
+            total_attempts INTEGER NOT NULL DEFAULT 0,
+            total_completions INTEGER NOT NULL DEFAULT 0,
+            best_attempt_time REAL NOT NULL DEFAULT {default_best_attempt['time']},
+            best_attempt_number INTEGER NOT NULL DEFAULT {default_best_attempt['attempt']},
+            best_completion_time REAL NOT NULL DEFAULT {default_best_completion['time']},
+            best_completion_number INTEGER NOT NULL DEFAULT {default_best_completion['attempt']}
+        )
+    ''')
+
+    for table in ('maps', 'sessions'):
+        async with database.execute(f'SELECT rowid, * FROM {table}') as cursor:
+            column_names = [description[0] for description in cursor.description]
+            rows = [dict(zip(column_names, row)) for row in await cursor.fetchall()]
+        for row in rows:
+            best_attempt = parse_best(row.pop('best_attempt'), default_best_attempt)
+            best_completion = parse_best(row.pop('best_completion'), default_best_completion)
+            row.update({'id': row.pop('rowid'),
+                        'best_attempt_time': best_attempt['time'], 'best_attempt_number': best_attempt['attempt'],
+                        'best_completion_time': best_completion['time'],
+                        'best_completion_number': best_completion['attempt']})
+            await database.execute(f'INSERT INTO {table}_new ({", ".join(row)}) VALUES ({", ".join("?" * len(row))})',
+                                   list(row.values()))
+        await database.execute(f'DROP TABLE {table}')
+        await database.execute(f'ALTER TABLE {table}_new RENAME TO {table}')
+
+    await database.execute('''
+        CREATE TABLE attempts (
+            id INTEGER PRIMARY KEY,
+            map TEXT NOT NULL REFERENCES maps (name),
+            session INTEGER NOT NULL REFERENCES sessions (id),
+            attempt INTEGER NOT NULL,
+            start REAL NOT NULL,
+            duration REAL NOT NULL,
+            outcome TEXT NOT NULL CHECK (outcome IN ('stopped', 'escaped')),
+            matched TEXT
+        )
+    ''')
+    await database.execute('CREATE INDEX attempts_map_duration ON attempts (map, duration)')
+    await database.execute('CREATE INDEX attempts_session ON attempts (session)')
+    await database.execute('CREATE INDEX sessions_map ON sessions (map)')
+
+
+# applied in order, the database's user_version is how many of them it has had
+migrations = [
+    create_tables,
+    add_attempts_and_typed_bests,
+    create_stats_tables,
+    create_music_table,
+]
+
+
+async def migrate(database):
+    """Brings the database up to the latest schema, one transaction per migration."""
+    async with database.execute('PRAGMA user_version') as cursor:
+        version = (await cursor.fetchone())[0]
+    for number, migration in enumerate(migrations[version:], version + 1):
+        await database.execute('BEGIN')
+        try:
+            await migration(database)
+            await database.execute(f'PRAGMA user_version = {number}')
+            await database.commit()
+        except Exception:
+            await database.rollback()
+            raise
+        logger.info(f"Migrated database to version {number} ({migration.__name__})")
+
+
 async def create_database(database_name: str):
     async with aiosqlite.connect(database_name) as database:
-        await database.execute('''
-            CREATE TABLE IF NOT EXISTS maps (
-                name TEXT not null primary key,
-                song TEXT,
-                total_attempts integer NOT NULL,
-                total_completions integer NOT NULL,
-                best_attempt text NOT NULL,
-                best_completion text NOT NULL
-            )
-        ''')
-
-        await database.execute('''
-            CREATE TABLE IF NOT EXISTS sessions (
-                map text not null,
-                session_start integer NOT NULL,
-                session_end integer,
-                total_attempts integer NOT NULL,
-                total_completions integer NOT NULL,
-                best_attempt text NOT NULL,
-                best_completion text NOT NULL,
-                FOREIGN KEY (map) REFERENCES maps (name)
-                )
-        ''')
-
-        await database.commit()
+        await migrate(database)
+
+
+async def connect_database(database_name: str):
+    """
+    Opens the database in WAL mode with synchronous=NORMAL, so a commit appends to the log instead of waiting on an
+    fsync of the whole database. The data is still safe if the tracker crashes, only an OS crash or power loss can
+    lose the last few commits. Databases from older versions are migrated in place.
+    """
+    database = await aiosqlite.connect(database_name)
+    await database.execute('PRAGMA journal_mode=WAL')
+    await database.execute('PRAGMA synchronous=NORMAL')
+    await migrate(database)
+    return database
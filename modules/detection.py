@@ -0,0 +1,101 @@
+import re
+
+
+def template_label(detection: dict) -> str:
+    return f"[Template: {detection['name']} ({detection['score']:.2f})]"
+
+
+def countdown_digit(name: str):
+    """The number countdown text or a template name ends in, e.g. 3 for 'get ready: 3' or 'get_ready_3'."""
+    found = re.search(r'(\d)\s*$', name)
+    return int(found.group(1)) if found else None
+
+
+def phrase_label(match: dict) -> str:
+    if match['score'] == 100:
+        return match['phrase']
+    return f"{match['phrase']} [Fuzzy: {match['score']:.0f}]"
+
+
+class RunDetector:
+    """
+    The run state machine: turns processed frames (`check`) and the stop/complete hotkeys (`key`) into run events.
+
+    Both return None or an event dict:
+    {'event': 'start' | 'stop' | 'escape', 'time': time.time() the event happened, 'match': what triggered it,
+     'phrase': the PhraseMatcher result if text triggered it, 'countdown': True if a start was read off the countdown,
+     'hotkey': True if a hotkey triggered it, 'digit': the countdown number that was read, if any}
+
+    A start's time is when the round actually begins: `countdown_delay` after the last number of the countdown was on
+    screen, plus `countdown_interval` for every number still to come when a higher one was read. The number is taken
+    from the text OCR actually read (or the template that matched), never from the phrase it was matched to, so a
+    countdown whose number wasn't legible is timed as the last one. Times are relative to when the frame was captured,
+    so a frame that took a while to read doesn't push the start back.
+    """
+
+    def __init__(self, trigger_regions: dict, matcher, hotkeys: dict = None, countdown_delay: float = 1.2,
+                 countdown_interval: float = 1.0):
+        self.trigger_regions = trigger_regions
+        self.matcher = matcher
+        self.hotkeys = {'g': 'stop', 'c': 'escape'} if hotkeys is None else hotkeys
+        self.countdown_delay = countdown_delay
+        self.countdown_interval = countdown_interval
+        self.running = False
+        self.started_at = 0.0
+
+    def trigger_text(self, texts: dict, trigger: str) -> str:
+        return " ".join(texts.get(region, '') for region in self.trigger_regions[trigger])
+
+    def event(self, kind: str, event_time: float, match: str, phrase: dict = None, countdown: bool = False,
+              hotkey: bool = False, digit: int = None) -> dict:
+        return {'event': kind, 'time': event_time, 'match': match, 'phrase': phrase, 'countdown': countdown,
+                'hotkey': hotkey, 'digit': digit}
+
+    async def check(self, frame):
+        detections = frame.detections
+        if not self.running:
+            text = self.trigger_text(frame.texts, 'play')
+            phrase = self.matcher.match(text, 'play')
+            if 'play' in detections:
+                match = template_label(detections['play'])
+                name = detections['play']['name']
+                countdown = name.startswith('get_ready')
+            elif phrase:
+                match = phrase_label(phrase)
+                # the phrase may have a number the text doesn't, only what was read counts
+                name = text[phrase['start']:phrase['end']]
+                countdown = phrase['phrase'].startswith('get ready')
+            else:
+                return None
+
+            self.running = True
+            digit = countdown_digit(name) if countdown else None
+            start = frame.captured_at
+            if countdown:
+                start += self.countdown_delay + self.countdown_interval * max((digit or 1) - 1, 0)
+            self.started_at = start
+            return self.event('start', start, match, phrase, countdown, digit=digit)
+
+        phrase = self.matcher.match(self.trigger_text(frame.texts, 'stop'), 'stop')
+        if 'stop' in detections or phrase:
+            self.running = False
+            match = template_label(detections['stop']) if 'stop' in detections else phrase_label(phrase)
+            return self.event('stop', frame.captured_at, match, phrase)
+
+        phrase = self.matcher.match(self.trigger_text(frame.texts, 'escaped'), 'escaped')
+        if 'escaped' in detections or phrase:
+            self.running = False
+            match = template_label(detections['escaped']) if 'escaped' in detections else phrase_label(phrase)
+            return self.event('escape', frame.captured_at, match, phrase)
+        return None
+
+    def key(self, key: str, pressed_at: float):
+        """
+        Stops or completes the run, as of when the key was pressed, for keys in `hotkeys` ({key: 'stop' | 'escape'},
+        g and c by default). Presses from before the run are ignored.
+        """
+        action = self.hotkeys.get(key)
+        if not self.running or pressed_at < self.started_at or action is None:
+            return None
+        self.running = False
+        return self.event(action, pressed_at, f"[Hotkey: {key}]", hotkey=True)
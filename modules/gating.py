@@ -0,0 +1,62 @@
+import numpy as np
+
+
+class FrameGate:
+    """
+    Skips OCR for capture regions that haven't changed since they were last read.
+
+    Every region is reduced to a subsampled grayscale array and compared against the frame that was last
+    sent to OCR (not simply the previous frame, so slow fades still add up to a change). The difference is measured
+    per tile of `tile` x `tile` samples, so a short word appearing in a big region isn't averaged away: when the mean
+    absolute difference of every tile stays under `threshold` (0-255 scale) the region's last text is reused.
+    """
+
+    def __init__(self, threshold: float = 4.0, sample_step: int = 4, tile: int = 8):
+        self.threshold = threshold
+        self.sample_step = sample_step
+        self.tile = tile
+        self.signatures = {}
+        self.pending = {}
+        self.texts = {}
+        self.frames = 0
+        self.skipped = 0
+
+    def _signature(self, image) -> np.ndarray:
+        if not isinstance(image, np.ndarray):
+            image = np.asarray(image.convert('L'))
+        image = image[::self.sample_step, ::self.sample_step]
+        if image.ndim == 3:
+            image = image[..., :3].mean(axis=2)
+        return image.astype(np.int16)
+
+    def difference(self, signature: np.ndarray, previous: np.ndarray) -> float:
+        """The largest mean absolute difference of any tile, edge tiles included."""
+        difference = np.abs(signature - previous).astype(np.int32)
+        rows = np.arange(0, difference.shape[0], self.tile)
+        columns = np.arange(0, difference.shape[1], self.tile)
+        sums = np.add.reduceat(np.add.reduceat(difference, rows, axis=0), columns, axis=1)
+        counts = np.outer(np.diff(rows, append=difference.shape[0]), np.diff(columns, append=difference.shape[1]))
+        return float((sums / counts).max())
+
+    def changed(self, images: dict) -> dict:
+        """Returns the subset of `images` that differs enough from the last OCR'd frame to need reading again."""
+        self.frames += 1
+        changed = {}
+        for name, image in images.items():
+            signature = self._signature(image)
+            previous = self.signatures.get(name)
+            if (previous is None or previous.shape != signature.shape or name not in self.texts
+                    or self.difference(signature, previous) > self.threshold):
+                changed[name] = image
+                self.pending[name] = signature
+        if not changed:
+            self.skipped += 1
+        return changed
+
+    def update(self, texts: dict) -> dict:
+        """Stores freshly recognized text and returns the text of every region, reusing cached reads."""
+        for name, text in texts.items():
+            self.texts[name] = text
+            if name in self.pending:
+                self.signatures[name] = self.pending.pop(name)
+        return dict(self.texts)
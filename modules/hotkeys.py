@@ -0,0 +1,39 @@
+import asyncio
+
+
+class KeyboardHotkeys:
+    """
+    Reads hotkeys from the real keyboard.
+
+    Each key is hooked once, and every press is queued with the time it happened, so a tap is never missed between two
+    slow frames and a manual stop is timed from the press rather than from when it was noticed. Has to be created on
+    the event loop that reads it.
+    """
+
+    def __init__(self, keys=('g', 'c', 'k', 'm')):
+        import keyboard
+        self.keyboard = keyboard
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+        self.hooks = [keyboard.on_press_key(key, lambda event, key=key: self._on_press(key, event)) for key in keys]
+
+    def _on_press(self, key: str, event):
+        # runs on the keyboard hook's thread
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, (key, event.time))
+
+    async def get(self, timeout: float = None):
+        """Waits for the next (key, time.time() it was pressed), or None after `timeout` seconds."""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def clear(self):
+        """Forgets presses that haven't been read yet."""
+        while not self.queue.empty():
+            self.queue.get_nowait()
+
+    def close(self):
+        for hook in self.hooks:
+            self.keyboard.unhook(hook)
+        self.hooks = []
@@ -1,4 +1,7 @@
+import json
 import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
 
 
 def add_logging_level(levelName, levelNum, methodName=None):
@@ -50,3 +53,44 @@ def add_logging_level(levelName, levelNum, methodName=None):
     setattr(logging, levelName, levelNum)
     setattr(logging.getLoggerClass(), methodName, logForLevel)
     setattr(logging, methodName, logToRoot)
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per record, for a log that can be read back for analysis. Anything passed as
+    `extra={'data': {...}}` is included under "data".
+    """
+
+    def format(self, record):
+        entry = {'time': record.created, 'level': record.levelname, 'logger': record.name,
+                 'source': f"{record.filename}:{record.lineno}", 'message': record.getMessage()}
+        if data := getattr(record, 'data', None):
+            entry['data'] = data
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class LocalQueueHandler(QueueHandler):
+    """
+    Queues records as they are. The stock QueueHandler formats the message on the logging thread and drops the
+    traceback to keep records picklable, which a queue inside this process doesn't need, so merging the message,
+    formatting and tracebacks all happen on the listener's thread and reach every handler intact.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+def start_queue_logging(loggers: list, handlers: list) -> QueueListener:
+    """
+    Points `loggers` at a queue that `handlers` are fed from on a background thread, so logging a record never waits
+    on the console or the disk. Call `stop()` on the returned listener to flush what's left before exiting.
+    """
+    log_queue = queue.SimpleQueue()
+    queue_handler = LocalQueueHandler(log_queue)
+    for logger in loggers:
+        logger.addHandler(queue_handler)
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    return listener
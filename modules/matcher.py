@@ -0,0 +1,78 @@
+import re
+
+import numpy as np
+from rapidfuzz import fuzz, process
+from rapidfuzz.distance import Levenshtein
+
+
+class PhraseMatcher:
+    """
+    Every trigger phrase, compiled once, matched against OCR text in one batched rapidfuzz call per trigger.
+
+    `phrases` is a list of dicts like:
+    - {'trigger': 'play', 'phrase': 'get ready: 3', 'max_distance': 3, 'exclude': ['..']}
+      found anywhere in the text with up to `max_distance` substitutions (default 0, an exact substring), unless
+      the text contains one of the `exclude` strings. Text shorter than the phrase has to be the whole phrase with up
+      to `max_distance` edits, so a scrap of it never counts as a perfect match
+    - {'trigger': 'escaped', 'pattern': r'(\\d+)/(\\d+) escaped'}
+      a regular expression, checked before the fuzzy phrases
+
+    `match` returns {'trigger', 'phrase', 'score', 'start', 'end'} for the best match, where start/end are the
+    position of the match in the text, or None.
+    """
+
+    def __init__(self, phrases: list):
+        self.groups = {}
+        for entry in phrases:
+            group = self.groups.setdefault(entry['trigger'], {'patterns': [], 'phrases': [], 'max_distances': [],
+                                                              'excludes': []})
+            if 'pattern' in entry:
+                group['patterns'].append(re.compile(entry['pattern']))
+                continue
+            group['phrases'].append(entry['phrase'])
+            group['max_distances'].append(entry.get('max_distance', 0))
+            group['excludes'].append(tuple(entry.get('exclude', ())))
+
+        for group in self.groups.values():
+            lengths = np.array([len(phrase) for phrase in group['phrases']], dtype=np.float64)
+            distances = np.array(group['max_distances'], dtype=np.float64)
+            group['lengths'] = lengths
+            group['distances'] = distances
+            # partial_ratio is 100 * (1 - substitutions / length) for a same-length window
+            group['cutoffs'] = 100 * (1 - distances / np.maximum(lengths, 1))
+
+    def match(self, text: str, trigger: str):
+        group = self.groups.get(trigger)
+        if not text or group is None:
+            return None
+
+        for pattern in group['patterns']:
+            if found := pattern.search(text):
+                return {'trigger': trigger, 'phrase': found.group(0), 'score': 100.0,
+                        'start': found.start(), 'end': found.end()}
+
+        if not group['phrases']:
+            return None
+        lengths = group['lengths']
+        # partial_ratio slides the phrase along the text, which only means something if the text can hold all of it.
+        # shorter text is compared as a whole, or the characters it's missing wouldn't cost anything
+        partial_scores = process.cdist([text], group['phrases'], scorer=fuzz.partial_ratio, dtype=np.float64)[0]
+        edits = process.cdist([text], group['phrases'], scorer=Levenshtein.distance, dtype=np.float64)[0]
+        holds_phrase = len(text) >= lengths
+        scores = np.where(holds_phrase, partial_scores, 100 * (1 - edits / np.maximum(lengths, 1)))
+        accepted = np.where(holds_phrase, partial_scores >= group['cutoffs'], edits <= group['distances'])
+        for i, excludes in enumerate(group['excludes']):
+            if accepted[i] and any(exclude in text for exclude in excludes):
+                accepted[i] = False
+        if not accepted.any():
+            return None
+
+        # best score wins, ties go to the longer (more specific) phrase
+        ranking = np.where(accepted, scores * 1000 + group['lengths'], -1)
+        best = int(np.argmax(ranking))
+        phrase = group['phrases'][best]
+        if not holds_phrase[best]:
+            return {'trigger': trigger, 'phrase': phrase, 'score': float(scores[best]), 'start': 0, 'end': len(text)}
+        alignment = fuzz.partial_ratio_alignment(phrase, text)
+        return {'trigger': trigger, 'phrase': phrase, 'score': float(scores[best]),
+                'start': alignment.dest_start, 'end': alignment.dest_end}
@@ -0,0 +1,113 @@
+import bisect
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+# upper bounds in seconds, anything slower lands in the +Inf bucket
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class Histogram:
+    """Fixed-bucket latency histogram. Observing is O(log buckets) and memory doesn't grow with the session."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, q: float) -> float:
+        """Estimates the q-th quantile (0-1) by interpolating inside the bucket it falls in."""
+        if self.count == 0:
+            return 0.0
+        target = q * self.count
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            if count and cumulative + count >= target:
+                if i == len(self.buckets):
+                    return self.max
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = min(self.buckets[i], self.max)
+                return lower + (upper - lower) * (target - cumulative) / count
+            cumulative += count
+        return self.max
+
+    def summary(self) -> str:
+        return (f"p50 {self.percentile(0.5) * 1000:.1f}ms p95 {self.percentile(0.95) * 1000:.1f}ms "
+                f"p99 {self.percentile(0.99) * 1000:.1f}ms max {self.max * 1000:.1f}ms (n={self.count})")
+
+
+class Metrics:
+    """
+    Per-stage timings of the detection loop, plus a few counters.
+
+    Stages are created the first time they're observed. `summary()` gives a one-line overview for the log and `write()`
+    dumps everything in the Prometheus text exposition format so it can be scraped or diffed between machines.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.histograms = {}
+        self.counters = {}
+        self.last_summary = time.perf_counter()
+
+    def observe(self, stage: str, seconds: float):
+        if stage not in self.histograms:
+            self.histograms[stage] = Histogram(self.buckets)
+        self.histograms[stage].observe(seconds)
+
+    def observe_frame(self, frame):
+        for stage, seconds in frame.timings.items():
+            self.observe(stage, seconds)
+
+    @contextmanager
+    def time(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def set_counter(self, name: str, value: int):
+        self.counters[name] = value
+
+    def summary(self) -> str:
+        return " | ".join(f"{stage} {histogram.summary()}" for stage, histogram in self.histograms.items())
+
+    def summary_due(self, interval: float) -> bool:
+        """True once every `interval` seconds, for periodic summary lines."""
+        now = time.perf_counter()
+        if now - self.last_summary < interval:
+            return False
+        self.last_summary = now
+        return True
+
+    def exposition(self) -> str:
+        lines = ["# HELP fe2_stage_seconds Time spent in each stage of the detection loop",
+                 "# TYPE fe2_stage_seconds histogram"]
+        for stage, histogram in self.histograms.items():
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f'fe2_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'fe2_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {histogram.count}')
+            lines.append(f'fe2_stage_seconds_sum{{stage="{stage}"}} {histogram.sum:.6f}')
+            lines.append(f'fe2_stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+        for name, value in self.counters.items():
+            lines.append(f"# TYPE fe2_{name}_total counter")
+            lines.append(f"fe2_{name}_total {value}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str):
+        """Writes the metrics atomically, so a scraper never reads a half-written file."""
+        path = Path(path)
+        temp_path = path.with_name(path.name + '.tmp')
+        temp_path.write_text(self.exposition(), encoding='utf-8')
+        temp_path.replace(path)
@@ -0,0 +1,144 @@
+import asyncio
+import logging
+import os
+from pathlib import Path
+
+from rapidfuzz import fuzz, process
+
+try:
+    import mutagen
+except ImportError:
+    mutagen = None
+
+logger = logging.getLogger(__name__)
+
+extensions = {'.mp3', '.ogg', '.wav'}
+fuzzy_cutoff = 60
+
+schema = [
+    '''
+    CREATE TABLE music (
+        path TEXT PRIMARY KEY,
+        mtime_ns INTEGER NOT NULL,
+        size INTEGER NOT NULL,
+        name TEXT NOT NULL,
+        search_name TEXT NOT NULL,
+        duration REAL,
+        title TEXT,
+        artist TEXT,
+        album TEXT
+    )
+    ''',
+    'CREATE INDEX music_search_name ON music (search_name)',
+]
+
+
+async def create_music_table(database):
+    for statement in schema:
+        await database.execute(statement)
+
+
+def walk(directory: str) -> dict:
+    """{path: (mtime_ns, size)} of every song under `directory`, paths relative like 'music/artist/song.mp3'."""
+    songs = {}
+    pending = [directory]
+    while pending:
+        try:
+            entries = list(os.scandir(pending.pop()))
+        except OSError:
+            continue
+        for entry in entries:
+            if entry.is_dir():
+                pending.append(entry.path)
+            elif os.path.splitext(entry.name)[1] in extensions:
+                stat = entry.stat()
+                songs[entry.path.replace('\\', '/')] = (stat.st_mtime_ns, stat.st_size)
+    return songs
+
+
+def read_metadata(path: str) -> dict:
+    metadata = {'duration': None, 'title': None, 'artist': None, 'album': None}
+    if mutagen is None:
+        return metadata
+    try:
+        audio = mutagen.File(path, easy=True)
+    except Exception as e:
+        logger.warning(f"Couldn't read tags of {path}: {e}")
+        return metadata
+    if audio is None:
+        return metadata
+    metadata['duration'] = getattr(audio.info, 'length', None)
+    for tag in ('title', 'artist', 'album'):
+        if values := (audio.tags or {}).get(tag):
+            metadata[tag] = values[0]
+    return metadata
+
+
+def index_row(path: str, stat: tuple) -> tuple:
+    metadata = read_metadata(path)
+    name = metadata['title'] or Path(path).stem
+    if metadata['artist']:
+        name = f"{metadata['artist']} - {name}"
+    return (path, *stat, name, name.lower(), metadata['duration'], metadata['title'], metadata['artist'],
+            metadata['album'])
+
+
+async def update_music_index(database, directory: str = 'music') -> int:
+    """
+    Brings the music table in line with `directory`. Only songs that are new or whose mtime or size changed get their
+    tags read, so a startup with an unchanged library is one directory walk. Songs indexed without a length are read
+    again while mutagen is installed, so installing it later fills in the ones indexed before. Returns how many songs
+    are indexed.
+    """
+    on_disk = await asyncio.to_thread(walk, directory)
+    async with database.execute('SELECT path, mtime_ns, size, duration FROM music') as cursor:
+        rows = await cursor.fetchall()
+    indexed = {path: (mtime_ns, size) for path, mtime_ns, size, _ in rows}
+    unread = {path for path, _, _, duration in rows if duration is None} if mutagen is not None else set()
+    changed = [(path, stat) for path, stat in on_disk.items() if indexed.get(path) != stat or path in unread]
+    removed = indexed.keys() - on_disk.keys()
+    if not changed and not removed:
+        return len(on_disk)
+
+    rows = await asyncio.to_thread(lambda: [index_row(path, stat) for path, stat in changed])
+    await database.executemany('INSERT OR REPLACE INTO music VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+    await database.executemany('DELETE FROM music WHERE path = ?', [[path] for path in removed])
+    await database.commit()
+    logger.debug(f"Music index: {len(changed)} songs added or changed, {len(removed)} removed")
+    return len(on_disk)
+
+
+async def search_music(database, query: str, limit: int = 10) -> list:
+    """
+    Songs whose name starts with `query` (case-insensitive, from the index), topped up with the closest fuzzy matches
+    on name and path.
+    """
+    query = query.strip().lower()
+    columns = 'path, name, duration, title, artist, album'
+    async with database.execute(f'SELECT {columns} FROM music WHERE search_name >= ? AND search_name < ? '
+                                f'ORDER BY search_name LIMIT ?', [query, query + '\U0010ffff', limit]) as cursor:
+        column_names = [description[0] for description in cursor.description]
+        results = [dict(zip(column_names, row)) for row in await cursor.fetchall()]
+    if len(results) >= limit:
+        return results
+
+    async with database.execute(f'SELECT {columns} FROM music') as cursor:
+        songs = [dict(zip(column_names, row)) for row in await cursor.fetchall()]
+    found = {song['path'] for song in results}
+    choices = {i: f"{song['name']} {song['path']}".lower() for i, song in enumerate(songs) if song['path'] not in found}
+    for _, _, i in process.extract(query, choices, scorer=fuzz.WRatio, score_cutoff=fuzzy_cutoff,
+                                   limit=limit - len(results)):
+        results.append(songs[i])
+    return results
+
+
+async def song_available(database, path: str) -> bool:
+    """Whether `path` (as stored on a map) is in the index and still on disk."""
+    async with database.execute('SELECT 1 FROM music WHERE path = ?', [path]) as cursor:
+        return await cursor.fetchone() is not None and Path(path).is_file()
+
+
+def format_duration(seconds) -> str:
+    if seconds is None:
+        return "?:??"
+    return f"{int(seconds // 60)}:{int(seconds % 60):02}"
@@ -0,0 +1,182 @@
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pytesseract
+from PIL import Image
+
+from modules.preprocess import preprocess
+
+try:
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+logger = logging.getLogger(__name__)
+
+
+class PytesseractEngine:
+    """
+    Fallback backend. Every call writes a temp image and spawns a fresh tesseract process,
+    so the language model is reloaded for every frame.
+    """
+    name = 'pytesseract'
+
+    def __init__(self, lang: str = 'eng', tesseract_cmd: str = None):
+        self.lang = lang
+        if tesseract_cmd:
+            pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
+
+    def image_to_string(self, image, psm: int = None, whitelist: str = None) -> str:
+        config = []
+        if psm is not None:
+            config.append(f'--psm {psm}')
+        if whitelist:
+            config.append(f'-c tessedit_char_whitelist={whitelist}')
+        return pytesseract.image_to_string(image, lang=self.lang, config=' '.join(config))
+
+    def close(self):
+        pass
+
+
+class TesserocrEngine:
+    """
+    Native libtesseract binding. The language model is loaded once when the engine is created
+    and the same API handle is reused for every frame.
+    """
+    name = 'tesserocr'
+
+    def __init__(self, lang: str = 'eng', tessdata_path: str = None):
+        self.lang = lang
+        if tessdata_path:
+            self.api = tesserocr.PyTessBaseAPI(path=tessdata_path, lang=lang)
+        else:
+            self.api = tesserocr.PyTessBaseAPI(lang=lang)
+
+    def image_to_string(self, image, psm: int = None, whitelist: str = None) -> str:
+        self.api.SetPageSegMode(psm if psm is not None else tesserocr.PSM.AUTO)
+        self.api.SetVariable('tessedit_char_whitelist', whitelist or '')
+        if isinstance(image, np.ndarray):
+            image = Image.fromarray(image)
+        self.api.SetImage(image)
+        return self.api.GetUTF8Text()
+
+    def close(self):
+        self.api.End()
+
+
+def find_tessdata(tesseract_cmd: str):
+    tessdata = Path(tesseract_cmd).parent / 'tessdata'
+    if tessdata.is_dir():
+        return str(tessdata)
+    return None
+
+
+def create_engine(backend: str = 'auto', lang: str = 'eng', tesseract_cmd: str = None):
+    """
+    Creates the OCR engine used by the capture loop.
+
+    `backend` is one of 'auto', 'tesserocr' or 'pytesseract'. 'auto' prefers the persistent
+    tesserocr engine and falls back to pytesseract when the binding isn't installed or
+    can't load the language data.
+    """
+    if backend not in ('auto', 'tesserocr', 'pytesseract'):
+        raise ValueError(f"Unknown OCR backend '{backend}'")
+
+    if backend in ('auto', 'tesserocr'):
+        if tesserocr is None:
+            if backend == 'tesserocr':
+                raise RuntimeError("OCR backend 'tesserocr' requested but tesserocr is not installed")
+        else:
+            tessdata_path = find_tessdata(tesseract_cmd) if tesseract_cmd else None
+            try:
+                engine = TesserocrEngine(lang, tessdata_path)
+                logger.debug(f"Using persistent tesserocr engine (tessdata: {tessdata_path or 'default'})")
+                return engine
+            except RuntimeError as e:
+                if backend == 'tesserocr':
+                    raise
+                logger.warning(f"Failed to start tesserocr, falling back to pytesseract: {e}")
+
+    logger.debug("Using pytesseract engine (one tesseract process per frame)")
+    return PytesseractEngine(lang, tesseract_cmd)
+
+
+def clean_text(text: str) -> str:
+    return text.strip().replace("\n", " ").lower()
+
+
+class OCRPool:
+    """
+    Runs OCR on several capture regions at once. Each worker thread lazily creates its own engine,
+    since a tesserocr handle can't be shared between threads.
+
+    `regions` maps a region name to its OCR settings, e.g. {'ready': {'psm': 7, 'whitelist': '0123456789'}}.
+    A region's 'preprocess' settings are applied on the worker before OCR (see modules/preprocess.py), and a region
+    with no text pixels left after thresholding isn't OCR'd at all.
+
+    One pool can serve several pipelines. Jobs run in the order they were submitted and each pipeline only has one
+    frame's regions in flight at a time, so pipelines take turns on the workers and a busy one can't starve the rest.
+    """
+
+    def __init__(self, regions: dict, backend: str = 'auto', lang: str = 'eng', tesseract_cmd: str = None,
+                 max_workers: int = None):
+        self.regions = regions
+        self.backend = backend
+        self.lang = lang
+        self.tesseract_cmd = tesseract_cmd
+        self.max_workers = max_workers or len(regions)
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='ocr')
+        self.local = threading.local()
+        self.engines = []
+        self.engines_lock = threading.Lock()
+        # create one engine up front so a missing backend fails here instead of mid-session
+        self.name = self.executor.submit(self._get_engine).result().name
+
+    def _get_engine(self):
+        engine = getattr(self.local, 'engine', None)
+        if engine is None:
+            engine = create_engine(self.backend, self.lang, self.tesseract_cmd)
+            self.local.engine = engine
+            with self.engines_lock:
+                self.engines.append(engine)
+        return engine
+
+    def warm_up(self):
+        """Starts every worker thread and loads its engine now, so the first frames of a session don't pay for it."""
+        # every worker waits for the others, so each job lands on its own thread
+        barrier = threading.Barrier(self.max_workers)
+
+        def load():
+            self._get_engine()
+            barrier.wait()
+
+        for future in [self.executor.submit(load) for _ in range(self.max_workers)]:
+            future.result()
+
+    def _read(self, region: str, image) -> str:
+        settings = self.regions.get(region, {})
+        if settings.get('preprocess'):
+            image = preprocess(image, settings['preprocess'])
+            if image is None:
+                return ''
+        text = self._get_engine().image_to_string(image, settings.get('psm'), settings.get('whitelist'))
+        return clean_text(text)
+
+    async def read_regions(self, images: dict) -> dict:
+        """Returns the recognized text for every region in `images`, keyed by region name."""
+        loop = asyncio.get_running_loop()
+        names = list(images)
+        results = await asyncio.gather(
+            *(loop.run_in_executor(self.executor, self._read, name, images[name]) for name in names)
+        )
+        return dict(zip(names, results))
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        for engine in self.engines:
+            engine.close()
+        self.engines.clear()
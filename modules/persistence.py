@@ -0,0 +1,86 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class PersistenceWriter:
+    """
+    Write-behind store for the session and map rows the detection loop keeps updating, and the attempts it records.
+
+    `update()` only records the new column values in memory, later values for the same row and column replacing earlier
+    ones, and `insert()` queues a new row, so the loop never waits on the disk. Pending changes are written in a single transaction every
+    `flush_interval` seconds and on `close()`, which also runs when the session is interrupted. Anything else written
+    on the same connection has to go through `write()`.
+    """
+
+    def __init__(self, database, flush_interval: float = 2.0):
+        self.database = database
+        self.flush_interval = flush_interval
+        self.pending = {}
+        self.inserts = []
+        self.lock = asyncio.Lock()
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.create_task(self._flush_loop(), name='persistence')
+
+    def update(self, table: str, rowid: int, **columns):
+        self.pending.setdefault((table, rowid), {}).update(columns)
+
+    def insert(self, table: str, **columns):
+        self.inserts.append((table, columns))
+
+    async def write(self, sql: str, parameters=()) -> int:
+        """
+        Runs one statement and commits it right away, for writes whose result is needed now, like a new row's id.
+        Goes through the same lock as `flush()`, so it never commits half of a flush or gets rolled back by a failed
+        one. Returns the rowid of the inserted row, if any.
+        """
+        async with self.lock:
+            try:
+                cursor = await self.database.execute(sql, parameters)
+                await self.database.commit()
+            except Exception:
+                await self.database.rollback()
+                raise
+            return cursor.lastrowid
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Failed to write pending changes, will retry: {e}")
+
+    async def flush(self):
+        async with self.lock:
+            if not self.pending and not self.inserts:
+                return
+            pending, self.pending = self.pending, {}
+            inserts, self.inserts = self.inserts, []
+            try:
+                for table, columns in inserts:
+                    await self.database.execute(f'INSERT INTO {table} ({", ".join(columns)}) '
+                                                f'VALUES ({", ".join("?" * len(columns))})', list(columns.values()))
+                for (table, rowid), columns in pending.items():
+                    assignments = ', '.join(f"{column} = ?" for column in columns)
+                    await self.database.execute(f'UPDATE {table} SET {assignments} WHERE rowid = ?',
+                                                [*columns.values(), rowid])
+                await self.database.commit()
+            except Exception:
+                await self.database.rollback()
+                # put the changes back underneath anything newer that came in while writing
+                for key, columns in pending.items():
+                    self.pending[key] = {**columns, **self.pending.get(key, {})}
+                self.inserts = inserts + self.inserts
+                raise
+            logger.debug(f"Wrote {len(inserts)} new rows and {len(pending)} row updates")
+
+    async def close(self):
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        await self.flush()
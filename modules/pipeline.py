@@ -0,0 +1,148 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Frame:
+    captured_at: float  # time.time() of the screen grab, used for run start/end times
+    captured_perf: float  # time.perf_counter() of the screen grab, used for latency measurements
+    images: dict
+    texts: dict = field(default_factory=dict)
+    ocr_regions: list = field(default_factory=list)
+    detections: dict = field(default_factory=dict)
+    timings: dict = field(default_factory=dict)  # seconds spent in each stage
+
+
+def put_latest(queue: asyncio.Queue, item) -> bool:
+    """Puts `item` on a bounded queue, dropping the oldest entry if it's full. Returns True if something was dropped."""
+    dropped = False
+    if queue.full():
+        queue.get_nowait()
+        dropped = True
+    queue.put_nowait(item)
+    return dropped
+
+
+class DetectionPipeline:
+    """
+    Capture -> template match / OCR -> match, as concurrent stages joined by bounded queues.
+
+    Frames come from `source.grab(regions)`, which returns (capture time, {region: image}) or None once a recording
+    runs out. With a `scheduler`, it picks the regions and the time between grabs, otherwise every region is grabbed
+    every `capture_interval` seconds.
+
+    The source is read on a worker thread, OCR runs on the OCR pool, and matching happens in whatever awaits
+    `next_frame()` on the event loop. When a stage falls behind, the queue in front of it keeps only the newest frame,
+    so a slow OCR pass or database commit never builds up a backlog of stale screens. `drop_stale=False` makes the
+    stages wait on each other instead, so a replay processes every recorded frame.
+    """
+
+    def __init__(self, source, ocr_pool, frame_gate, detector=None, scheduler=None, queue_size: int = 1,
+                 capture_interval: float = 0.0, unchanged_frame_sleep: float = 0.05, drop_stale: bool = True):
+        self.source = source
+        self.ocr_pool = ocr_pool
+        self.frame_gate = frame_gate
+        self.detector = detector
+        self.scheduler = scheduler
+        self.capture_interval = capture_interval
+        self.unchanged_frame_sleep = unchanged_frame_sleep
+        self.drop_stale = drop_stale
+        self.capture_queue = asyncio.Queue(maxsize=queue_size)
+        self.result_queue = asyncio.Queue(maxsize=queue_size)
+        self.idle = False
+        self.dropped = 0
+        self.before_run = 0  # frames next_frame() passed over for being captured before `after`
+        self.tasks = []
+
+    def _grab(self, regions: list = None):
+        grab_start = time.perf_counter()
+        grabbed = self.source.grab(regions)
+        if grabbed is None:
+            return None
+        captured_at, images = grabbed
+        captured_perf = time.perf_counter()
+        return Frame(captured_at, captured_perf, images, timings={'capture': captured_perf - grab_start})
+
+    async def _put(self, queue: asyncio.Queue, item):
+        if not self.drop_stale:
+            await queue.put(item)
+        elif put_latest(queue, item):
+            self.dropped += 1
+
+    async def _capture_stage(self):
+        while True:
+            tick_start = time.perf_counter()
+            regions = self.scheduler.regions() if self.scheduler else None
+            frame = await asyncio.to_thread(self._grab, regions)
+            await self._put(self.capture_queue, frame)
+            if frame is None:
+                return
+            interval = self.scheduler.interval() if self.scheduler else self.capture_interval
+            if self.idle:
+                interval = max(interval, self.unchanged_frame_sleep)
+            await asyncio.sleep(max(0.0, interval - (time.perf_counter() - tick_start)))
+
+    async def _ocr_stage(self):
+        while True:
+            frame = await self.capture_queue.get()
+            if frame is None:
+                await self._put(self.result_queue, None)
+                return
+
+            stage_start = time.perf_counter()
+            changed_images = self.frame_gate.changed(frame.images)
+            self.idle = not changed_images
+            detect_start = time.perf_counter()
+            frame.timings['gate'] = detect_start - stage_start
+            if self.detector and changed_images:
+                frame.detections = self.detector.detect(changed_images)
+            ocr_start = time.perf_counter()
+            frame.timings['templates'] = ocr_start - detect_start
+
+            # a confident template match answers for its region, OCR is only the fallback for the rest. detected
+            # regions stay out of the gate so they're matched again next frame instead of reusing stale text
+            detected_regions = {detection['region'] for detection in frame.detections.values()}
+            ocr_images = {name: image for name, image in changed_images.items() if name not in detected_regions}
+            texts = await self.ocr_pool.read_regions(ocr_images) if ocr_images else {}
+            # only regions captured in this frame, cached text for regions that weren't captured would be stale
+            frame.texts = {region: text for region, text in self.frame_gate.update(texts).items()
+                           if region in frame.images}
+            frame.texts.update({region: '' for region in detected_regions})
+            frame.ocr_regions = list(ocr_images)
+            frame.timings['ocr'] = time.perf_counter() - ocr_start
+            if self.scheduler:
+                self.scheduler.observe(frame)
+            await self._put(self.result_queue, frame)
+
+    def start(self):
+        self.tasks = [asyncio.create_task(self._capture_stage(), name='capture'),
+                      asyncio.create_task(self._ocr_stage(), name='ocr')]
+
+    async def next_frame(self, after: float = None):
+        """
+        Waits for the newest fully processed frame, skipping any captured before `after` (a time.time() value).
+        Returns None once the source has run out of frames.
+        """
+        while True:
+            get_frame = asyncio.create_task(self.result_queue.get())
+            stages = [task for task in self.tasks if not task.done()]
+            done, _ = await asyncio.wait([get_frame, *stages], return_when=asyncio.FIRST_COMPLETED)
+            if get_frame not in done:
+                get_frame.cancel()
+                for task in done:
+                    task.result()  # re-raise whatever killed the stage
+                continue
+            frame = get_frame.result()
+            if frame is None or after is None or frame.captured_at >= after:
+                return frame
+            self.before_run += 1
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
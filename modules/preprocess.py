@@ -0,0 +1,71 @@
+import numpy as np
+from PIL import Image
+
+from modules.templates import to_grayscale
+
+
+def to_gray(image: np.ndarray, mode: str = 'white') -> np.ndarray:
+    """
+    'white' keeps the darkest channel of every pixel, so only pixels that are bright in all channels (white UI text)
+    stay bright and saturated backgrounds go dark. 'luminance' is a regular grayscale conversion.
+    """
+    if image.ndim == 2:
+        return image
+    if mode == 'white':
+        return image[..., :3].min(axis=2)
+    return to_grayscale(image).astype(np.uint8)
+
+
+def text_bounds(mask: np.ndarray):
+    """(left, top, right, bottom) of the True pixels in `mask`, or None if there aren't any."""
+    rows = np.flatnonzero(mask.any(axis=1))
+    if rows.size == 0:
+        return None
+    columns = np.flatnonzero(mask.any(axis=0))
+    return columns[0], rows[0], columns[-1] + 1, rows[-1] + 1
+
+
+def preprocess(image, settings: dict):
+    """
+    Turns a captured region into a small black-on-white image for Tesseract, or None if there's no text in it at all.
+
+    `settings` (all optional):
+    - gray: 'white' (default) or 'luminance', see `to_gray`
+    - threshold: 0-255, pixels at or above it are text. None skips binarization
+    - crop: crop to the bounding box of the text pixels (default True, needs a threshold)
+    - padding: pixels of margin left around the text when cropping (default 6)
+    - text_height: rescale so the text block is this many pixels tall, for single line regions
+    - scale: fixed rescale factor, used when text_height isn't set
+    """
+    if not isinstance(image, np.ndarray):
+        image = np.asarray(image.convert('RGB'))
+    gray = to_gray(image, settings.get('gray', 'white'))
+
+    threshold = settings.get('threshold')
+    if threshold is None:
+        output = gray
+        text_height = gray.shape[0]
+    else:
+        mask = gray >= threshold
+        bounds = text_bounds(mask)
+        if bounds is None:
+            return None
+        left, top, right, bottom = bounds
+        text_height = bottom - top
+        if settings.get('crop', True):
+            padding = settings.get('padding', 6)
+            height, width = mask.shape
+            mask = mask[max(top - padding, 0):min(bottom + padding, height),
+                        max(left - padding, 0):min(right + padding, width)]
+        # tesseract reads dark text on a light background best
+        output = np.where(mask, 0, 255).astype(np.uint8)
+
+    scale = settings.get('scale')
+    if settings.get('text_height') and text_height > 0:
+        scale = min(max(settings['text_height'] / text_height, 0.5), 4.0)
+    if scale and scale != 1:
+        height, width = output.shape
+        resample = Image.NEAREST if threshold is not None else Image.BILINEAR
+        output = np.asarray(Image.fromarray(output).resize((max(round(width * scale), 1),
+                                                            max(round(height * scale), 1)), resample))
+    return output
@@ -0,0 +1,187 @@
+import io
+import json
+import logging
+import statistics
+import time
+import zipfile
+from pathlib import Path
+
+import numpy as np
+from PIL import Image, ImageGrab
+
+from modules.capture import ScreenCapture
+from modules.metrics import Metrics
+
+logger = logging.getLogger(__name__)
+
+frame_suffixes = {'.png', '.jpg', '.jpeg', '.bmp'}
+
+
+def parse_timestamp(name: str):
+    try:
+        return float(Path(name).stem)
+    except ValueError:
+        return None
+
+
+class ReplaySource(ScreenCapture):
+    """
+    Frame source that plays back a recording instead of grabbing the screen.
+
+    A recording is a directory or .zip of full-screen images named by their capture time (e.g. `1712345678.125.png`),
+    optionally with a `labels.json` of ground truth events: [{"time": 1712345680.2, "event": "start"}, ...].
+
+    With `realtime` the recording is paced by its timestamps and frames the pipeline is too slow for are skipped,
+    like a real screen would; otherwise every frame is handed out as fast as it's asked for.
+    """
+
+    def __init__(self, path: str, regions: dict, reference_resolution=(1920, 1080), realtime: bool = False):
+        super().__init__(regions, reference_resolution)
+        self.path = Path(path)
+        self.realtime = realtime
+        self.archive = zipfile.ZipFile(self.path) if zipfile.is_zipfile(self.path) else None
+        names = self.archive.namelist() if self.archive else [p.name for p in self.path.iterdir()]
+        self.frames = sorted((timestamp, name) for name in names
+                             if Path(name).suffix.lower() in frame_suffixes
+                             and (timestamp := parse_timestamp(name)) is not None)
+        self.labels = self._read_labels()
+        self.index = 0
+        self.started = None
+
+    def _open(self, name: str):
+        if self.archive:
+            return io.BytesIO(self.archive.read(name))
+        return open(self.path / name, 'rb')
+
+    def _read_labels(self) -> list:
+        if self.archive:
+            if 'labels.json' not in self.archive.namelist():
+                return []
+        elif not (self.path / 'labels.json').exists():
+            return []
+        with self._open('labels.json') as file:
+            return sorted(json.load(file), key=lambda label: label['time'])
+
+    def grab(self, regions: list = None):
+        if self.index >= len(self.frames):
+            return None
+        if self.realtime:
+            if self.started is None:
+                self.started = time.perf_counter()
+            first = self.frames[0][0]
+            elapsed = time.perf_counter() - self.started
+            # skip ahead to the newest frame that would be on screen by now
+            while self.index + 1 < len(self.frames) and self.frames[self.index + 1][0] - first <= elapsed:
+                self.index += 1
+            time.sleep(max(0.0, self.frames[self.index][0] - first - elapsed))
+
+        timestamp, name = self.frames[self.index]
+        self.index += 1
+        with self._open(name) as file:
+            frame = np.asarray(Image.open(file).convert('RGB'))
+        return timestamp, self.crop(frame, regions)
+
+    def close(self):
+        if self.archive:
+            self.archive.close()
+
+
+def record_frames(path: str, interval: float = 0.1, duration: float = None):
+    """Saves full-screen captures named by capture time to `path` until `duration` runs out or Ctrl+C."""
+    output = Path(path)
+    output.mkdir(parents=True, exist_ok=True)
+    started = time.perf_counter()
+    count = 0
+    try:
+        while duration is None or time.perf_counter() - started < duration:
+            tick_start = time.perf_counter()
+            screen = ImageGrab.grab()
+            screen.save(output / f"{time.time():.3f}.png", compress_level=1)
+            count += 1
+            time.sleep(max(0.0, interval - (time.perf_counter() - tick_start)))
+    except KeyboardInterrupt:
+        pass
+    logger.info(f"Recorded {count} frames to {output}")
+    return count
+
+
+async def replay(pipeline, run_detector, on_frame=None) -> list:
+    """
+    Runs every frame of `pipeline` through `run_detector`, the same way the tracker does, and returns the events.
+    `on_frame(frame, event, match_time)` is called after each frame.
+    """
+    events = []
+    pipeline.start()
+    try:
+        # like a live session, frames captured before the run started can't end it
+        while (frame := await pipeline.next_frame(after=run_detector.started_at if run_detector.running else None)
+               ) is not None:
+            match_start = time.perf_counter()
+            event = await run_detector.check(frame)
+            match_time = time.perf_counter() - match_start
+            if event:
+                events.append(event)
+            if on_frame:
+                on_frame(frame, event, match_time)
+    finally:
+        await pipeline.stop()
+    return events
+
+
+def score_events(events: list, labels: list, tolerance: float = 5.0) -> dict:
+    """Pairs every labelled event with the closest unused detection of the same kind within `tolerance` seconds."""
+    unused = list(events)
+    delays = {}
+    missed = []
+    for label in labels:
+        candidates = [event for event in unused
+                      if event['event'] == label['event'] and abs(event['time'] - label['time']) <= tolerance]
+        if not candidates:
+            missed.append(label)
+            continue
+        event = min(candidates, key=lambda candidate: abs(candidate['time'] - label['time']))
+        unused.remove(event)
+        delays.setdefault(label['event'], []).append(event['time'] - label['time'])
+    return {'delays': delays, 'missed': missed, 'false': unused}
+
+
+async def benchmark(pipeline, run_detector, labels: list, tolerance: float = 5.0, metrics=None) -> str:
+    """Replays a recording and returns a report of throughput, per-stage latency and detection accuracy."""
+    metrics = metrics or Metrics()
+
+    def on_frame(frame, event, match_time):
+        metrics.observe_frame(frame)
+        metrics.observe('match', match_time)
+        metrics.observe('end_to_end', time.perf_counter() - frame.captured_perf + frame.timings['capture'])
+
+    started = time.perf_counter()
+    events = await replay(pipeline, run_detector, on_frame)
+    elapsed = time.perf_counter() - started
+
+    # every frame that went through capture and the gate counts, including the ones matching passed over because they
+    # were captured before the run they'd have to end
+    frames = pipeline.frame_gate.frames
+    lines = [f"Processed {frames} frames in {elapsed:.2f} seconds ({frames / elapsed if elapsed else 0:.1f} frames/sec), "
+             f"{pipeline.frame_gate.skipped} skipped as unchanged, {pipeline.dropped} dropped as stale, "
+             f"{pipeline.before_run} captured before their run started"]
+    for stage, histogram in metrics.histograms.items():
+        lines.append(f"{stage:>11}: {histogram.summary()}")
+    metrics.set_counter('frames', frames)
+    metrics.set_counter('frames_unchanged', pipeline.frame_gate.skipped)
+    metrics.set_counter('frames_dropped', pipeline.dropped)
+    metrics.set_counter('frames_before_run', pipeline.before_run)
+
+    if labels:
+        score = score_events(events, labels, tolerance)
+        for kind, delays in score['delays'].items():
+            lines.append(f"{kind} detection delay: mean {statistics.fmean(delays):+.3f}s | "
+                         f"worst {max(delays, key=abs):+.3f}s ({len(delays)} detected)")
+        lines.append(f"{len(labels) - len(score['missed'])}/{len(labels)} labelled events detected, "
+                     f"{len(score['missed'])} missed, {len(score['false'])} false detections")
+        for label in score['missed']:
+            lines.append(f"  missed {label['event']} at {label['time']:.3f}")
+        for event in score['false']:
+            lines.append(f"  false {event['event']} at {event['time']:.3f} ({event['match']})")
+    else:
+        lines.append(f"{len(events)} events detected (no labels.json to score against)")
+    return "\n".join(lines)
@@ -0,0 +1,60 @@
+import time
+
+# any of these in the region the "GET READY" countdown shows up in means a countdown is probably on its way; the
+# other play regions show ordinary text, where 'rea' would be in "area", "great" or "break"
+countdown_hints = ('get', 'rea')
+countdown_hint_region = 'ready'
+
+
+class PollingScheduler:
+    """
+    Decides which regions to capture and how often, based on where the run is at.
+
+    - idle: no run going, only the play regions are watched, slowly
+    - armed: part of a countdown was seen, the play regions are watched as fast as allowed for `armed_timeout` seconds
+    - running: a run is going, only the stop and escaped regions are watched
+
+    On top of the per-state interval, `cpu_budget` (a fraction of one core) stretches the interval so capture and
+    OCR never take more than that share of the time.
+    """
+
+    def __init__(self, run_detector, trigger_regions: dict, idle_interval: float = 0.25, armed_interval: float = 0.0,
+                 running_interval: float = 0.1, armed_timeout: float = 5.0, cpu_budget: float = 0.5):
+        self.run_detector = run_detector
+        self.intervals = {'idle': idle_interval, 'armed': armed_interval, 'running': running_interval}
+        self.state_regions = {
+            'idle': list(dict.fromkeys(trigger_regions['play'])),
+            'armed': list(dict.fromkeys(trigger_regions['play'])),
+            'running': list(dict.fromkeys(trigger_regions['stop'] + trigger_regions['escaped'])),
+        }
+        self.armed_timeout = armed_timeout
+        self.cpu_budget = cpu_budget
+        self.armed_until = 0.0
+        self.work_time = 0.0  # moving average of seconds spent capturing and reading one frame
+
+    @property
+    def state(self) -> str:
+        if self.run_detector.running:
+            return 'running'
+        if time.perf_counter() < self.armed_until:
+            return 'armed'
+        return 'idle'
+
+    def regions(self) -> list:
+        return self.state_regions[self.state]
+
+    def interval(self) -> float:
+        budget_interval = 0.0
+        if self.cpu_budget:
+            budget_interval = self.work_time * (1 - self.cpu_budget) / self.cpu_budget
+        return max(self.intervals[self.state], budget_interval)
+
+    def observe(self, frame):
+        """Feeds a processed frame back in, to spot partial countdowns and track how much work a frame costs."""
+        work = sum(frame.timings.get(stage, 0.0) for stage in ('capture', 'gate', 'templates', 'ocr'))
+        self.work_time = work if self.work_time == 0 else self.work_time * 0.9 + work * 0.1
+        if self.run_detector.running:
+            return
+        hint_text = frame.texts.get(countdown_hint_region, '')
+        if 'play' in frame.detections or any(hint in hint_text for hint in countdown_hints):
+            self.armed_until = time.perf_counter() + self.armed_timeout
@@ -0,0 +1,104 @@
+import asyncio
+import logging
+import queue
+import threading
+import time
+from pathlib import Path
+
+from PIL import ImageGrab
+
+logger = logging.getLogger(__name__)
+
+extensions = {'png': '.png', 'webp': '.webp', 'jpeg': '.jpg'}
+
+
+class ScreenshotWriter:
+    """
+    Saves completion screenshots on a background thread so encoding never holds up the detection loop.
+
+    Screenshots wait in a bounded queue; if the disk can't keep up, new ones are dropped rather than queued forever.
+    After every save, the oldest screenshots beyond `keep` (and any older than `max_age_days`) are deleted.
+
+    `thumbnail` is an optional (width, height) to also save a small copy under `thumbnails/`.
+    """
+
+    def __init__(self, directory: str = 'images/completions', image_format: str = 'png', compress_level: int = 1,
+                 quality: int = 80, thumbnail=None, keep: int = None, max_age_days: float = None,
+                 queue_size: int = 4):
+        if image_format not in extensions:
+            raise ValueError(f"Unsupported screenshot format '{image_format}', use one of {', '.join(extensions)}")
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.image_format = image_format
+        self.compress_level = compress_level
+        self.quality = quality
+        self.thumbnail = tuple(thumbnail) if thumbnail else None
+        self.keep = keep
+        self.max_age_days = max_age_days
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.thread = threading.Thread(target=self._worker, name='screenshots', daemon=True)
+        self.thread.start()
+
+    def _save_options(self) -> dict:
+        if self.image_format == 'png':
+            return {'compress_level': self.compress_level}
+        return {'quality': self.quality}
+
+    def _save(self, image, name: str):
+        path = self.directory / f"{name}{extensions[self.image_format]}"
+        image.save(path, self.image_format.upper(), **self._save_options())
+        if self.thumbnail:
+            thumbnail_directory = self.directory / 'thumbnails'
+            thumbnail_directory.mkdir(exist_ok=True)
+            image.thumbnail(self.thumbnail)
+            image.save(thumbnail_directory / path.name, self.image_format.upper(), **self._save_options())
+        logger.debug(f"Saved screenshot {path}")
+
+    def _enforce_retention(self):
+        if self.keep is None and self.max_age_days is None:
+            return
+        screenshots = sorted((path for path in self.directory.iterdir() if path.is_file()),
+                             key=lambda path: path.stat().st_mtime, reverse=True)
+        expired = screenshots[self.keep:] if self.keep is not None else []
+        if self.max_age_days is not None:
+            cutoff = time.time() - self.max_age_days * 86400
+            expired += [path for path in screenshots[:self.keep] if path.stat().st_mtime < cutoff]
+        for path in expired:
+            path.unlink(missing_ok=True)
+            (self.directory / 'thumbnails' / path.name).unlink(missing_ok=True)
+        if expired:
+            logger.debug(f"Deleted {len(expired)} old screenshots")
+
+    def _worker(self):
+        while True:
+            job = self.queue.get()
+            try:
+                if job is None:
+                    return
+                self._save(*job)
+                self._enforce_retention()
+            except Exception as e:
+                logger.error(f"Failed to save screenshot: {e}")
+            finally:
+                self.queue.task_done()
+
+    def submit(self, image, name: str) -> bool:
+        """Queues `image` to be saved as `name` (without extension). Returns False if the queue was full."""
+        try:
+            self.queue.put_nowait((image, name))
+            return True
+        except queue.Full:
+            logger.warning(f"Screenshot queue is full, dropped {name}")
+            return False
+
+    async def capture(self, name: str, bbox=None) -> bool:
+        """Grabs the screen (or just the `bbox` part of it) off the event loop and queues it to be saved."""
+        image = await asyncio.to_thread(ImageGrab.grab, tuple(bbox) if bbox else None)
+        return self.submit(image, name)
+
+    def close(self):
+        """Waits for queued screenshots to be written, then stops the worker. Safe to call more than once."""
+        if not self.thread.is_alive():
+            return
+        self.queue.put(None)
+        self.thread.join()
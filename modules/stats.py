@@ -0,0 +1,194 @@
+import math
+import time
+
+from modules.metrics import Histogram
+
+# upper bounds in seconds of the run duration buckets: 1s apart up to 30s, then 2s up to 2 minutes, 5s up to 10 minutes
+# and 30s up to an hour. Anything longer lands in the +Inf bucket
+DURATION_BUCKETS = (tuple(range(1, 31)) + tuple(range(32, 121, 2)) + tuple(range(125, 601, 5))
+                    + tuple(range(630, 3601, 30)))
+
+# seconds a run has to last to show up in the survival table
+survival_checkpoints = (15, 30, 60, 90, 120, 180, 300, 600)
+
+# everything below is kept up to date by triggers on the attempts table, so recording a run costs a few primary key
+# upserts and reading a map's stats never touches its history
+schema = [
+    '''
+    CREATE TABLE duration_buckets (
+        bucket INTEGER PRIMARY KEY,
+        upper REAL NOT NULL
+    )
+    ''',
+    '''
+    CREATE TABLE map_stats (
+        map TEXT NOT NULL REFERENCES maps (name),
+        outcome TEXT NOT NULL,
+        runs INTEGER NOT NULL,
+        total_duration REAL NOT NULL,
+        total_squared REAL NOT NULL,
+        min_duration REAL NOT NULL,
+        max_duration REAL NOT NULL,
+        PRIMARY KEY (map, outcome)
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE TABLE map_duration_histogram (
+        map TEXT NOT NULL REFERENCES maps (name),
+        outcome TEXT NOT NULL,
+        bucket INTEGER NOT NULL REFERENCES duration_buckets (bucket),
+        runs INTEGER NOT NULL,
+        PRIMARY KEY (map, outcome, bucket)
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE TABLE session_stats (
+        session INTEGER PRIMARY KEY REFERENCES sessions (id),
+        map TEXT NOT NULL REFERENCES maps (name),
+        runs INTEGER NOT NULL,
+        completions INTEGER NOT NULL,
+        total_duration REAL NOT NULL,
+        longest_run REAL NOT NULL,
+        fastest_completion REAL
+    )
+    ''',
+    'CREATE INDEX session_stats_map ON session_stats (map, session)',
+    '''
+    CREATE TRIGGER attempts_update_stats AFTER INSERT ON attempts
+    BEGIN
+        INSERT INTO map_stats VALUES (NEW.map, NEW.outcome, 1, NEW.duration, NEW.duration * NEW.duration,
+                                      NEW.duration, NEW.duration)
+        ON CONFLICT (map, outcome) DO UPDATE SET
+            runs = runs + 1,
+            total_duration = total_duration + excluded.total_duration,
+            total_squared = total_squared + excluded.total_squared,
+            min_duration = min(min_duration, excluded.min_duration),
+            max_duration = max(max_duration, excluded.max_duration);
+
+        INSERT INTO map_duration_histogram
+        SELECT NEW.map, NEW.outcome, min(bucket), 1 FROM duration_buckets WHERE upper >= NEW.duration
+        ON CONFLICT (map, outcome, bucket) DO UPDATE SET runs = runs + 1;
+
+        INSERT INTO session_stats VALUES (NEW.session, NEW.map, 1, NEW.outcome = 'escaped', NEW.duration,
+                                          NEW.duration, iif(NEW.outcome = 'escaped', NEW.duration, NULL))
+        ON CONFLICT (session) DO UPDATE SET
+            runs = runs + 1,
+            completions = completions + excluded.completions,
+            total_duration = total_duration + excluded.total_duration,
+            longest_run = max(longest_run, excluded.longest_run),
+            fastest_completion = coalesce(min(fastest_completion, excluded.fastest_completion),
+                                          fastest_completion, excluded.fastest_completion);
+    END
+    ''',
+]
+
+# fills the aggregates from whatever history was recorded before they existed
+backfill = [
+    '''
+    INSERT INTO map_stats
+    SELECT map, outcome, count(*), sum(duration), sum(duration * duration), min(duration), max(duration)
+    FROM attempts GROUP BY map, outcome
+    ''',
+    '''
+    INSERT INTO map_duration_histogram
+    SELECT map, outcome, (SELECT min(bucket) FROM duration_buckets WHERE upper >= duration) AS run_bucket, count(*)
+    FROM attempts GROUP BY map, outcome, run_bucket
+    ''',
+    '''
+    INSERT INTO session_stats
+    SELECT session, map, count(*), sum(outcome = 'escaped'), sum(duration), max(duration),
+           min(iif(outcome = 'escaped', duration, NULL))
+    FROM attempts GROUP BY session
+    ''',
+]
+
+
+async def create_stats_tables(database):
+    for statement in schema:
+        await database.execute(statement)
+    await database.executemany('INSERT INTO duration_buckets VALUES (?, ?)',
+                               enumerate([*DURATION_BUCKETS, math.inf]))
+    for statement in backfill:
+        await database.execute(statement)
+
+
+def outcome_summary(row, histogram: Histogram) -> dict:
+    runs, total, squared, shortest, longest = row
+    mean = total / runs
+    return {'runs': runs, 'mean': mean, 'stdev': math.sqrt(max(squared / runs - mean * mean, 0.0)),
+            'min': shortest, 'max': longest,
+            'p50': histogram.percentile(0.5), 'p90': histogram.percentile(0.9), 'p99': histogram.percentile(0.99)}
+
+
+async def map_stats(database, map_name: str, session_count: int = 10) -> dict:
+    """
+    Aggregates for one map, read straight from the summary tables: a handful of rows per outcome plus
+    `session_count` sessions, however long the map's history is.
+    """
+    histograms = {}
+    async with database.execute('SELECT outcome, bucket, runs FROM map_duration_histogram WHERE map = ?',
+                                [map_name]) as cursor:
+        async for outcome, bucket, runs in cursor:
+            histograms.setdefault(outcome, Histogram(DURATION_BUCKETS)).counts[bucket] = runs
+
+    outcomes = {}
+    async with database.execute('SELECT outcome, runs, total_duration, total_squared, min_duration, max_duration '
+                                'FROM map_stats WHERE map = ?', [map_name]) as cursor:
+        async for outcome, *row in cursor:
+            histogram = histograms.setdefault(outcome, Histogram(DURATION_BUCKETS))
+            histogram.count, histogram.sum, histogram.max = row[0], row[1], row[4]
+            outcomes[outcome] = outcome_summary(row, histogram)
+
+    # every run, however it ended, for the survival table
+    combined = Histogram(DURATION_BUCKETS)
+    for histogram in histograms.values():
+        combined.counts = [a + b for a, b in zip(combined.counts, histogram.counts)]
+        combined.count += histogram.count
+        combined.max = max(combined.max, histogram.max)
+    survival = {}
+    for checkpoint in survival_checkpoints:
+        if checkpoint > combined.max:
+            break
+        shorter = sum(combined.counts[:DURATION_BUCKETS.index(checkpoint) + 1])
+        survival[checkpoint] = (combined.count - shorter) / combined.count
+
+    async with database.execute('SELECT session_stats.*, sessions.session_start FROM session_stats '
+                                'JOIN sessions ON sessions.id = session_stats.session '
+                                'WHERE session_stats.map = ? ORDER BY session DESC LIMIT ?',
+                                [map_name, session_count]) as cursor:
+        column_names = [description[0] for description in cursor.description]
+        sessions = [dict(zip(column_names, row)) for row in await cursor.fetchall()]
+    sessions.reverse()
+    previous_mean = None
+    for session in sessions:
+        session['mean'] = session['total_duration'] / session['runs']
+        session['mean_change'] = session['mean'] - previous_mean if previous_mean is not None else None
+        session['completion_rate'] = session['completions'] / session['runs']
+        previous_mean = session['mean']
+
+    runs = combined.count
+    completions = outcomes.get('escaped', {}).get('runs', 0)
+    return {'map': map_name, 'runs': runs, 'completions': completions,
+            'completion_rate': completions / runs if runs else 0.0, 'outcomes': outcomes, 'survival': survival,
+            'sessions': sessions}
+
+
+def format_stats(stats: dict) -> str:
+    lines = [f"{stats['map']}: {stats['runs']} runs, {stats['completions']} completions "
+             f"({stats['completion_rate']:.1%} completion rate)"]
+    for outcome, summary in stats['outcomes'].items():
+        lines.append(f"  {outcome}: {summary['runs']} runs | mean {summary['mean']:.1f}s (sd {summary['stdev']:.1f}s) | "
+                     f"p50 {summary['p50']:.1f}s p90 {summary['p90']:.1f}s p99 {summary['p99']:.1f}s | "
+                     f"min {summary['min']:.1f}s max {summary['max']:.1f}s")
+    if stats['survival']:
+        lines.append("  survived: " + ", ".join(f"{checkpoint}s {share:.1%}"
+                                                for checkpoint, share in stats['survival'].items()))
+    if stats['sessions']:
+        lines.append(f"  last {len(stats['sessions'])} sessions:")
+    for session in stats['sessions']:
+        change = f" ({session['mean_change']:+.1f}s)" if session['mean_change'] is not None else ""
+        fastest = f" | fastest {session['fastest_completion']:.1f}s" if session['fastest_completion'] else ""
+        started = time.strftime('%Y-%m-%d %H:%M', time.localtime(session['session_start']))
+        lines.append(f"    {started}: {session['runs']} runs, {session['completions']} completions | "
+                     f"mean {session['mean']:.1f}s{change} | longest {session['longest_run']:.1f}s{fastest}")
+    return "\n".join(lines)
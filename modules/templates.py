@@ -0,0 +1,142 @@
+import logging
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+GRAYSCALE_WEIGHTS = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+
+def to_grayscale(image) -> np.ndarray:
+    if not isinstance(image, np.ndarray):
+        image = np.asarray(image.convert('RGB'))
+    if image.ndim == 3:
+        return image[..., :3].astype(np.float32) @ GRAYSCALE_WEIGHTS
+    return image.astype(np.float32)
+
+
+def downsample(image: np.ndarray, factor: int) -> np.ndarray:
+    """Block-averages a grayscale image by `factor` on both axes."""
+    if factor <= 1:
+        return image
+    height, width = image.shape[0] // factor * factor, image.shape[1] // factor * factor
+    return image[:height, :width].reshape(height // factor, factor, width // factor, factor).mean(axis=(1, 3))
+
+
+def fast_length(n: int) -> int:
+    """Smallest length >= n with no prime factors above 5, which FFTs handle far faster than odd sizes."""
+    while True:
+        m = n
+        for prime in (2, 3, 5):
+            while m % prime == 0:
+                m //= prime
+        if m == 1:
+            return n
+        n += 1
+
+
+def window_sums(integral: np.ndarray, height: int, width: int) -> np.ndarray:
+    """Sums of every height x width window, from a zero-padded integral image."""
+    return (integral[height:, width:] - integral[:-height, width:]
+            - integral[height:, :-width] + integral[:-height, :-width])
+
+
+class Template:
+    def __init__(self, trigger: str, name: str, image: np.ndarray):
+        self.trigger = trigger
+        self.name = name
+        self.height, self.width = image.shape
+        zero_mean = image - image.mean()
+        self.norm = float(np.sqrt((zero_mean ** 2).sum()))
+        # flipped so the FFT product is a correlation rather than a convolution
+        self.kernel = zero_mean[::-1, ::-1]
+        self.spectra = {}
+
+    def spectrum(self, shape):
+        if shape not in self.spectra:
+            self.spectra[shape] = np.fft.rfft2(self.kernel, shape)
+        return self.spectra[shape]
+
+    def match(self, image: np.ndarray, cache: dict = None):
+        """
+        Normalized cross-correlation of the template against every position in `image`.
+        Returns (best score, (x, y)) where a score of 1.0 is a pixel-perfect match.
+
+        `cache` holds the image's FFTs and integral images so several templates can share them.
+        """
+        image_height, image_width = image.shape
+        if image_height < self.height or image_width < self.width or self.norm == 0:
+            return 0.0, None
+        if cache is None:
+            cache = {}
+
+        shape = (fast_length(image_height + self.height - 1), fast_length(image_width + self.width - 1))
+        if shape not in cache:
+            cache[shape] = np.fft.rfft2(image, shape)
+        correlation = np.fft.irfft2(cache[shape] * self.spectrum(shape), shape)
+        correlation = correlation[self.height - 1:image_height, self.width - 1:image_width]
+
+        if 'integrals' not in cache:
+            padded = np.pad(image.astype(np.float64), ((1, 0), (1, 0)))
+            cache['integrals'] = padded.cumsum(0).cumsum(1), (padded ** 2).cumsum(0).cumsum(1)
+        integral, integral_sq = cache['integrals']
+        area = self.height * self.width
+        local_sum = window_sums(integral, self.height, self.width)
+        local_variance = window_sums(integral_sq, self.height, self.width) - local_sum ** 2 / area
+        denominator = np.sqrt(np.maximum(local_variance, 0)) * self.norm
+
+        scores = np.zeros_like(correlation)
+        np.divide(correlation, denominator, out=scores, where=denominator > 1e-6)
+        y, x = np.unravel_index(np.argmax(scores), scores.shape)
+        return float(scores[y, x]), (int(x), int(y))
+
+
+class TemplateDetector:
+    """
+    Fast path for fixed-font UI elements (the countdown, the escaped banner) that skips OCR.
+
+    Templates are loaded from `templates/<trigger>/<name>.png`, where trigger is 'play', 'stop' or 'escaped', and are
+    searched for in the regions `trigger_regions` lists for that trigger. They must be cropped from captures taken at
+    the resolution the tracker runs at. Matching runs on images downsampled by `downscale` to keep it to a few ms.
+    """
+
+    def __init__(self, trigger_regions: dict, templates_path: str = 'templates', threshold: float = 0.85,
+                 downscale: int = 2):
+        self.trigger_regions = trigger_regions
+        self.threshold = threshold
+        self.downscale = downscale
+        self.templates = []
+        for path in sorted(Path(templates_path).glob('*/*.png')):
+            trigger = path.parent.name
+            if trigger not in trigger_regions:
+                logger.warning(f"Ignoring template {path}, '{trigger}' is not a trigger")
+                continue
+            image = downsample(to_grayscale(Image.open(path)), downscale)
+            self.templates.append(Template(trigger, path.stem, image))
+        if self.templates:
+            logger.debug(f"Loaded {len(self.templates)} templates from {templates_path}")
+
+    def detect(self, images: dict) -> dict:
+        """
+        Returns {trigger: detection} for every trigger with a template scoring above the threshold, where a detection is
+        {'name': template name, 'region': region name, 'score': NCC score, 'position': (x, y)}.
+        """
+        detections = {}
+        grayscale = {}
+        caches = {}
+        for template in self.templates:
+            for region in self.trigger_regions[template.trigger]:
+                if region not in images:
+                    continue
+                if region not in grayscale:
+                    grayscale[region] = downsample(to_grayscale(images[region]), self.downscale)
+                    caches[region] = {}
+                score, position = template.match(grayscale[region], caches[region])
+                best = detections.get(template.trigger)
+                if score >= self.threshold and (best is None or score > best['score']):
+                    position = (position[0] * self.downscale, position[1] * self.downscale)
+                    detections[template.trigger] = {'name': template.name, 'region': region,
+                                                    'score': score, 'position': position}
+        return detections
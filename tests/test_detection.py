@@ -0,0 +1,21 @@
+import asyncio
+
+import pytest
+
+from modules.detection import RunDetector
+from modules.matcher import PhraseMatcher
+from modules.pipeline import Frame
+from tests.test_matcher import play_phrases
+
+trigger_regions = {'play': ['ready', 'rescue'], 'stop': ['notifications'], 'escaped': ['rescue']}
+
+
+@pytest.mark.parametrize('text, digit, delay', [("get ready: 3", 3, 3.2), ("get ready: 2", 2, 2.2),
+                                                ("get ready: 1", 1, 1.2), ("get ready", None, 1.2),
+                                                ("et ready: ", None, 1.2)])
+def test_start_is_timed_from_the_digit_that_was_read(text, digit, delay):
+    run_detector = RunDetector(trigger_regions, PhraseMatcher(play_phrases))
+    event = asyncio.run(run_detector.check(Frame(100.0, 0.0, {}, texts={'ready': text, 'rescue': ''})))
+    assert event['event'] == 'start'
+    assert event['digit'] == digit
+    assert event['time'] == pytest.approx(100.0 + delay)
@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw, ImageFont
+
+from modules.gating import FrameGate
+
+
+def region(size, text=None, text_height=24, noise=0):
+    image = Image.new('RGB', size, (40, 60, 90))
+    if text:
+        ImageDraw.Draw(image).text((20, 20), text, fill='white', font=ImageFont.load_default(size=text_height))
+    pixels = np.asarray(image).astype(np.int16)
+    if noise:
+        pixels += np.random.default_rng(0).integers(-noise, noise + 1, pixels.shape, dtype=np.int16)
+    return np.clip(pixels, 0, 255).astype(np.uint8)
+
+
+@pytest.mark.parametrize('size, text, text_height', [((680, 150), "GET READY: 3", 24), ((680, 150), "GET READY: 3", 32),
+                                                     ((700, 300), "You drowned", 24), ((700, 300), "You drowned", 32)])
+def test_small_text_in_a_large_region_is_a_change(size, text, text_height):
+    gate = FrameGate()
+    assert gate.changed({'region': region(size)})
+    gate.update({'region': ''})
+    assert gate.changed({'region': region(size, text, text_height)})
+
+
+def test_unchanged_region_is_skipped():
+    gate = FrameGate()
+    gate.changed({'region': region((680, 150))})
+    gate.update({'region': ''})
+    assert not gate.changed({'region': region((680, 150), noise=2)})
+    assert gate.skipped == 1
@@ -0,0 +1,39 @@
+import pytest
+
+from modules.matcher import PhraseMatcher
+
+play_phrases = [
+    {'trigger': 'play', 'phrase': "get ready: "},
+    {'trigger': 'play', 'phrase': "get ready: 3", 'max_distance': 3, 'exclude': [".."]},
+    {'trigger': 'play', 'phrase': "get ready: 2", 'max_distance': 3, 'exclude': [".."]},
+    {'trigger': 'play', 'phrase': "get ready: 1", 'max_distance': 3, 'exclude': [".."]},
+    {'trigger': 'play', 'phrase': "rescue"},
+]
+
+
+@pytest.fixture
+def matcher():
+    return PhraseMatcher(play_phrases)
+
+
+@pytest.mark.parametrize('text', ["get ready", "get ready:", "et ready: "])
+def test_partial_countdown_is_not_a_perfect_digit_match(matcher, text):
+    match = matcher.match(text, 'play')
+    if match:
+        assert match['score'] < 100
+        assert not any(character.isdigit() for character in text[match['start']:match['end']])
+
+
+@pytest.mark.parametrize('text, phrase', [("get ready: 3", "get ready: 3"), ("round 4 get ready: 2 ok", "get ready: 2"),
+                                          ("get ready: ", "get ready: ")])
+def test_full_phrase_matches(matcher, text, phrase):
+    match = matcher.match(text, 'play')
+    assert match['phrase'] == phrase
+    assert match['score'] == 100
+    assert text[match['start']:match['end']] == phrase
+
+
+def test_short_text_within_max_distance(matcher):
+    match = matcher.match("get redy: 1", 'play')
+    assert match['phrase'] == "get ready: 1"
+    assert (match['start'], match['end']) == (0, len("get redy: 1"))
@@ -0,0 +1,31 @@
+import asyncio
+import wave
+
+import aiosqlite
+
+from modules import music
+
+
+async def index_twice(directory, monkeypatch):
+    async with aiosqlite.connect(':memory:') as database:
+        await music.create_music_table(database)
+        with monkeypatch.context() as patch:
+            patch.setattr(music, 'mutagen', None)
+            await music.update_music_index(database, directory)
+        durations = []
+        for _ in range(2):
+            async with database.execute('SELECT duration FROM music') as cursor:
+                durations.append((await cursor.fetchone())[0])
+            await music.update_music_index(database, directory)
+        return durations
+
+
+def test_songs_indexed_without_mutagen_are_read_again(tmp_path, monkeypatch):
+    with wave.open(str(tmp_path / 'song.wav'), 'wb') as song:
+        song.setnchannels(1)
+        song.setsampwidth(2)
+        song.setframerate(8000)
+        song.writeframes(b'\0\0' * 8000)
+    before, after = asyncio.run(index_twice(str(tmp_path), monkeypatch))
+    assert before is None
+    assert after == 1.0
@@ -0,0 +1,29 @@
+import asyncio
+
+import aiosqlite
+import pytest
+
+from modules.persistence import PersistenceWriter
+
+
+async def failed_flush_keeps_direct_writes():
+    async with aiosqlite.connect(':memory:') as database:
+        await database.execute('CREATE TABLE sessions (id INTEGER PRIMARY KEY, map TEXT, total_attempts INTEGER)')
+        persistence = PersistenceWriter(database)
+        persistence.update('sessions', 1, total_attempts=3)
+        persistence.insert('missing', value=1)
+        flush = asyncio.create_task(persistence.flush())
+        await asyncio.sleep(0)  # let the flush take the lock before the direct write
+        run_id = await persistence.write('INSERT INTO sessions (map) VALUES (?)', ['map'])
+        with pytest.raises(aiosqlite.OperationalError):
+            await flush
+        async with database.execute('SELECT id, map FROM sessions') as cursor:
+            rows = await cursor.fetchall()
+        return run_id, rows, persistence.inserts, persistence.pending
+
+
+def test_failed_flush_keeps_direct_writes():
+    run_id, rows, inserts, pending = asyncio.run(failed_flush_keeps_direct_writes())
+    assert rows == [(run_id, 'map')]
+    assert inserts == [('missing', {'value': 1})]
+    assert pending == {('sessions', 1): {'total_attempts': 3}}
@@ -0,0 +1,17 @@
+import pytest
+
+from modules.detection import RunDetector
+from modules.matcher import PhraseMatcher
+from modules.pipeline import Frame
+from modules.scheduler import PollingScheduler
+from tests.test_detection import trigger_regions
+from tests.test_matcher import play_phrases
+
+
+@pytest.mark.parametrize('texts, armed', [({'ready': 'get rea', 'rescue': ''}, True),
+                                          ({'ready': '', 'rescue': 'escape the area'}, False),
+                                          ({'ready': '', 'rescue': 'great, take a break'}, False)])
+def test_partial_countdown_is_only_looked_for_in_the_ready_region(texts, armed):
+    scheduler = PollingScheduler(RunDetector(trigger_regions, PhraseMatcher(play_phrases)), trigger_regions)
+    scheduler.observe(Frame(100.0, 0.0, {}, texts=texts))
+    assert (scheduler.state == 'armed') == armed